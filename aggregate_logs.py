@@ -0,0 +1,238 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from filter_logs import FilterIndex, InputParams, _filter_key
+from metrics import cached
+
+# Rolling averages are computed for all window sizes up to this at once
+MAX_ROLLING_WINDOW = 25
+# Plots with more points than this only get a sample of each group,
+# so the figures sent to the browser stay small.
+MAX_PLOT_POINTS = 5000
+PLOT_SAMPLE_SIZE = 250
+
+# Filters that are already decided by the group key, e.g. a profession filter when
+# grouping by "profession+name". Other filters need the single rows.
+_KEY_FILTERS = {
+    "profession": ["profession"],
+    "name": ["name"],
+    "account": ["account"],
+    "profession+name": ["profession", "name"],
+}
+_FILTER_COLUMNS = {
+    "account": "account_name_filter",
+    "name": "character_name_filter",
+    "profession": "profession_filter",
+}
+
+
+@dataclass
+class GroupPartials:
+    # Sums, counts and sums of squares per (group, log) of the selected columns,
+    # accumulated over the logs of each group in timeStart order.
+    # The totals of any time range are then the difference of two rows.
+    groups: pd.DataFrame  # sorted group keys with the values of their _KEY_FILTERS
+    columns: List[str]
+    times: np.ndarray  # sorted unique timeStart of all logs
+    # (group position << 32) + position of the timeStart in `times`, per partial row
+    positions: np.ndarray
+    # running totals with a leading row of zeros
+    sums: np.ndarray
+    counts: np.ndarray
+    squares: np.ndarray
+
+
+@cached(st.cache_resource(max_entries=4, show_spinner=False))
+def _group_partials(
+    version: str, group_by: str, columns: tuple[str, ...], _df: pd.DataFrame
+) -> GroupPartials:
+    # `version` identifies the content of `_df`, see `filter_index`.
+    # Only built for the columns of the selected stat category to save memory.
+    numeric = _df[list(columns)].astype("float64")
+    times = np.unique(_df["timeStart"].to_numpy())
+    key_columns = [group_by] + [c for c in _KEY_FILTERS[group_by] if c != group_by]
+    groups = (
+        _df[key_columns]
+        .drop_duplicates(group_by)
+        .sort_values(group_by)
+        .reset_index(drop=True)
+    )
+    keys = [
+        pd.Index(groups[group_by]).get_indexer(_df[group_by]),
+        np.searchsorted(times, _df["timeStart"].to_numpy()),
+    ]
+    grouped = numeric.groupby(keys, sort=True)
+    sums = grouped.sum()
+    counts = grouped.count()
+    squares = (numeric**2).groupby(keys, sort=True).sum()
+
+    def running(totals: pd.DataFrame, dtype) -> np.ndarray:
+        values = totals.to_numpy(dtype=dtype)
+        return np.vstack([np.zeros((1, values.shape[1]), dtype), values.cumsum(0)])
+
+    group_positions = sums.index.get_level_values(0).to_numpy(dtype=np.int64)
+    time_positions = sums.index.get_level_values(1).to_numpy(dtype=np.int64)
+    return GroupPartials(
+        groups,
+        list(numeric.columns),
+        times,
+        (group_positions << 32) + time_positions,
+        running(sums, np.float64),
+        running(counts, np.int32),
+        running(squares, np.float64),
+    )
+
+
+def _uses_key_filters_only(filters: InputParams) -> bool:
+    return all(
+        column in _KEY_FILTERS[filters.group_by]
+        for column, attribute in _FILTER_COLUMNS.items()
+        if getattr(filters, attribute)
+    )
+
+
+def group_statistics(
+    index: FilterIndex, filters: InputParams, df: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Means and variances of the numeric columns of the filtered `df` per group.
+    # Computed from the partials of `_group_partials`, so the cost depends on
+    # the number of groups instead of the number of rows.
+    columns = [
+        c for c in df.select_dtypes(include="number").columns if c != filters.group_by
+    ]
+    if not _uses_key_filters_only(filters):
+        # Filters on other columns than the group key need the single rows
+        groups = df.groupby(filters.group_by, observed=True)[columns]
+        return groups.mean(), groups.var()
+
+    partials = _group_partials(
+        index.version, filters.group_by, tuple(columns), index.df
+    )
+    first = np.searchsorted(partials.times, pd.Timestamp(filters.start_time_min))
+    last = np.searchsorted(
+        partials.times, pd.Timestamp(filters.start_time_max), side="right"
+    )
+    group_positions = np.arange(len(partials.groups), dtype=np.int64) << 32
+    start = np.searchsorted(partials.positions, group_positions + first)
+    end = np.searchsorted(partials.positions, group_positions + last)
+
+    keys = partials.groups[filters.group_by]
+    selected = keys.notna().to_numpy() & (end > start)
+    for column in _KEY_FILTERS[filters.group_by]:
+        values = getattr(filters, _FILTER_COLUMNS[column])
+        if values:
+            selected &= partials.groups[column].isin(values).to_numpy()
+
+    start = start[selected]
+    end = end[selected]
+    sums, counts, squares = (
+        totals[end] - totals[start]
+        for totals in (partials.sums, partials.counts, partials.squares)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+        variances = np.where(
+            counts > 1, (squares - sums * means) / (counts - 1), np.nan
+        )
+
+    group_index = pd.Index(keys[selected], name=filters.group_by)
+    return (
+        pd.DataFrame(means, index=group_index, columns=columns),
+        pd.DataFrame(variances, index=group_index, columns=columns),
+    )
+
+
+def group_metadata(df: pd.DataFrame, group_by: str) -> pd.DataFrame:
+    # The most common profession and color of each group, for coloring the groups in plots.
+    # Ties are resolved like `value_counts().idxmax()`.
+    def dominant(column: str) -> pd.Series:
+        counts = df.groupby([group_by, column], observed=True).size()
+        counts = counts.sort_values(ascending=False, kind="stable")
+        top = counts.index[~counts.index.get_level_values(0).duplicated()]
+        return pd.Series(
+            top.get_level_values(1), index=top.get_level_values(0).rename(group_by)
+        )
+
+    return pd.DataFrame(
+        {"spec": dominant("profession"), "color": dominant("spec_color")}
+    )
+
+
+def _triangular_weights(window: int) -> np.ndarray:
+    # Same as scipy.signal.windows.triang, used by rolling(win_type="triang")
+    n = np.arange(1, (window + 1) // 2 + 1)
+    if window % 2 == 0:
+        half = (2 * n - 1.0) / window
+        return np.r_[half, half[::-1]]
+    half = 2 * n / (window + 1.0)
+    return np.r_[half, half[-2::-1]]
+
+
+# Row w - 1 holds the normalized weights of window size w, aligned to the right
+_ROLLING_WEIGHTS = np.zeros((MAX_ROLLING_WINDOW, MAX_ROLLING_WINDOW))
+for _window in range(1, MAX_ROLLING_WINDOW + 1):
+    _weights = _triangular_weights(_window)
+    _ROLLING_WEIGHTS[_window - 1, -_window:] = _weights / _weights.sum()
+
+
+# The result is only read, so every slider move shares it instead of copying it.
+# Few entries, as the dataset version changes while logs are fetched (see filter_index).
+@cached(
+    st.cache_resource(
+        max_entries=10,
+        show_spinner=False,
+        hash_funcs={FilterIndex: lambda index: index.version, InputParams: _filter_key},
+    )
+)
+def rolling_averages(
+    index: FilterIndex,
+    filters: InputParams,
+    group_by: str,
+    stat: str,
+    _df: pd.DataFrame,
+) -> pd.DataFrame:
+    # Triangular rolling averages of `stat` within each group for all window sizes
+    # 1..MAX_ROLLING_WINDOW (columns), like groupby().rolling(w, win_type="triang").mean().
+    # `_df` is the data filtered by `filters`, so it is not hashed.
+    # All rows of a group next to each other, in their original order
+    # rows without a group get -1
+    group_ids = (
+        _df.groupby(group_by, observed=True, sort=False)
+        .ngroup()
+        .fillna(-1)
+        .to_numpy(dtype=np.int64)
+    )
+    order = np.argsort(group_ids, kind="stable")
+    positions = pd.Series(group_ids).groupby(group_ids).cumcount().to_numpy()
+    values = _df[stat].to_numpy(dtype=np.float64)[order]
+
+    # One window of the previous MAX_ROLLING_WINDOW values per row
+    padded = np.r_[np.zeros(MAX_ROLLING_WINDOW - 1), values]
+    windows = np.lib.stride_tricks.sliding_window_view(padded, MAX_ROLLING_WINDOW)
+    missing = np.isnan(windows)
+    averages = np.where(missing, 0, windows) @ _ROLLING_WEIGHTS.T
+    # Windows that reach into the previous group or contain missing values are empty
+    incomplete = (missing @ (_ROLLING_WEIGHTS.T > 0)) > 0
+    too_short = positions[order, np.newaxis] < np.arange(MAX_ROLLING_WINDOW)
+    averages[incomplete | too_short] = np.nan
+
+    result = np.empty_like(averages)
+    result[order] = averages
+    result[group_ids < 0] = np.nan
+    return pd.DataFrame(
+        result, index=_df.index, columns=range(1, MAX_ROLLING_WINDOW + 1)
+    )
+
+
+def distribution_sample(values: pd.Series, size: int = PLOT_SAMPLE_SIZE) -> np.ndarray:
+    # At most `size` values with the same distribution as `values`:
+    # the sorted values are split into strata of equal count and one value is
+    # taken from each, so quantiles, minimum and maximum are kept.
+    values = np.sort(values.dropna().to_numpy())
+    if len(values) <= size:
+        return values
+    return values[np.linspace(0, len(values) - 1, size).round().astype(np.int64)]
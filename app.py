@@ -1,14 +1,34 @@
 import logging
-import os
+from datetime import timedelta
 
 import streamlit as st
 
-from fetch_logs import fetch_data
-from filter_logs import filter_data, get_inputs
+from aggregate_logs import group_metadata, group_statistics
+from fetch_logs import (
+    configured_tokens,
+    duplicate_logs,
+    fetch_data,
+    fetch_progress,
+    log_dates,
+    memory_usage,
+    rejected_logs,
+    skipped_uploads,
+)
+from filter_logs import filter_data, filter_index, get_inputs
+from metrics import (
+    cache_statistics,
+    counters,
+    prometheus_text,
+    serve,
+    timed,
+    timing_breakdown,
+)
 from tools.boon_overview import render_boon_overview
 from tools.stat_comparison import render_stat_comparison
 
 logging.basicConfig(filename="myapp.log", level=logging.INFO)
+# Prometheus metrics on GW2_METRICS_ADDRESS:GW2_METRICS_PORT, if the port is set
+serve()
 st.set_page_config(layout="wide")
 # Inject css to increase the default sidebar size
 st.markdown(
@@ -22,12 +42,10 @@ st.markdown(
 )
 
 
-# parse userTokens from env
-userTokens = {"Custom": ""}
-if "DPS_REPORT_TOKENS" in os.environ:
-    for token in os.environ["DPS_REPORT_TOKENS"].split(","):
-        name, value = token.split(":")
-        userTokens |= {name: value.strip()}
+userTokens = {"Custom": ""} | configured_tokens()
+DEFAULT_WINDOW = timedelta(days=30)
+# Seconds between two checks for more logs while they are fetched in the background
+PROGRESS_REFRESH = 2
 
 
 # fetch data
@@ -65,18 +83,82 @@ tool_selector = st.sidebar.selectbox("Tool selection:", options=TOOLS)
 if not userToken:
     st.stop()
 
-df = fetch_data(userToken)  # type: ignore
-filters = get_inputs(df, tool_selector)
-df = filter_data(df, filters)
-groups = df.groupby(filters.group_by)
-group_means = groups.mean(numeric_only=True)
+# Only the logs of the selected days are loaded
+dates = log_dates(userToken)
+if dates is None:
+    first_day = last_day = None
+else:
+    window = st.sidebar.date_input(
+        "Load logs between:",
+        value=(max(dates[0], dates[1] - DEFAULT_WINDOW), dates[1]),
+        min_value=dates[0],
+        max_value=dates[1],
+        help="Older logs are only loaded when they are selected here.",
+    )
+    if len(window) != 2:
+        st.stop()
+    first_day, last_day = window
+
+with timed("fetch data"):
+    df, data_version = fetch_data(userToken, first_day, last_day)  # type: ignore
+
+
+@st.fragment(run_every=PROGRESS_REFRESH)
+def render_fetch_progress():
+    # Renders the page again with the logs that were merged meanwhile
+    progress = fetch_progress(userToken)
+    if progress is None or progress.version != data_version:
+        st.rerun()
+    st.progress(
+        progress.processed / progress.total,
+        text=f"Fetched {progress.processed} of {progress.total} new logs,"
+        " the results below are updated as they arrive.",
+    )
+
+
+if fetch_progress(userToken) is not None:
+    render_fetch_progress()
+if df.empty:
+    if fetch_progress(userToken) is None:
+        st.write("No logs found for this userToken (yet).")
+    st.stop()
+with timed("filter index"):
+    index = filter_index(data_version, df)
+filters = get_inputs(index, tool_selector)
+with timed("filter"):
+    df = filter_data(index, filters)
+with timed("group statistics"):
+    groups = df.groupby(filters.group_by, observed=True)
+    group_means, group_variances = group_statistics(index, filters, df)
+    group_info = group_metadata(df, filters.group_by)
 
 DEBUG = st.sidebar.checkbox("Show debug data")
 if DEBUG:
+    st.write("Uploads skipped before downloading:", skipped_uploads(userToken))
+    st.write("Duplicate logs of the same fight:", duplicate_logs(userToken))
+    st.write("Rejected and failed logs:", rejected_logs(userToken))
+    st.write("Memory usage of all logs (bytes):", memory_usage(userToken))
     st.write(f"Filtered absolute data: {df.shape}:", df)
     st.write(f"Filtered averaged data: {group_means.shape}:", group_means)
+    st.write(f"Filtered variances: {group_variances.shape}:", group_variances)
 
+figures = {}
 if tool_selector == "Stat comparison":
-    render_stat_comparison(df, groups, group_means, filters)
+    figures = render_stat_comparison(
+        index, df, groups, group_means, group_info, filters
+    )
 elif tool_selector == "Boon overview":
-    render_boon_overview(groups, group_means, filters)
+    render_boon_overview(group_info, group_means, filters)
+
+if DEBUG and figures:
+    st.write(
+        "Figure payload sent to the browser (bytes):",
+        {name: len(fig.to_json()) for name, fig in figures.items()},
+    )
+if DEBUG:
+    # Totals of this server process, rendered last to include this page load
+    st.write("Time spent per stage (all sessions):", timing_breakdown())
+    st.write("Cache calls per cached function:", cache_statistics())
+    st.write("Counters:", counters())
+    with st.expander("Prometheus metrics"):
+        st.code(prometheus_text(), language="text")
@@ -0,0 +1,245 @@
+import argparse
+import copy
+import json
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from aggregate_logs import _group_partials, group_statistics
+from fetch_logs import _data_version, drop_duplicate_logs, merge_logs
+from filter_logs import InputParams, filter_data, filter_index
+from process_logs import compact_frame, strip_log_data, transform_log
+from synthetic_logs import synthetic_log
+
+# Benchmarks the processing pipeline on synthetic logs, see synthetic_logs.py.
+# Every stage records its time and the peak of the memory allocated by it,
+# and fails if either grew beyond the tolerance compared to a stored baseline.
+# Baselines depend on the machine, so create one before changing the code:
+#   python benchmark.py --save-baseline
+SIZES = [10, 100, 1_000, 10_000]
+BASELINE_PATH = Path("benchmark_baseline.json")
+TIME_TOLERANCE = 0.3
+MEMORY_TOLERANCE = 0.1
+# Every stage is timed this often and only the fastest run is compared,
+# the others were slowed down by something else on the machine.
+REPEATS = 5
+# Differences below these are noise, even if they exceed the tolerance
+_MIN_SECONDS = 0.05
+_MIN_PEAK_BYTES = 1024 * 1024
+# The time and memory per log of the per log stages do not depend on the number of logs,
+# so they are only measured for the first logs (repeatedly, see REPEATS).
+_PER_LOG_SAMPLE = 100
+
+
+def _traced(function, *args):
+    # Returns the result of `function` and the peak of the memory allocated while it ran
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _measure(function, *args, repeats: int = REPEATS) -> tuple:
+    # Times the runs first, tracing it again afterwards does not skew the time
+    runs = [_timed(function, *args) for _ in range(repeats)]
+    result = runs[0][0]
+    _, peak = _traced(function, *args)
+    return result, {"seconds": min(s for _, s in runs), "peak_bytes": peak}
+
+
+def _process_logs(count: int, players: int) -> list:
+    # Processes `count` logs one by one like the downloader does
+    frames = []
+    for seed in range(count):
+        log = strip_log_data(synthetic_log(seed, players))
+        frames.append(transform_log(log, f"synthetic{seed}"))
+        if (seed + 1) % 1000 == 0:
+            logging.info(f"Processed {seed + 1} of {count} logs.")
+    return frames
+
+
+def _per_log_seconds(count: int, players: int, repeats: int) -> dict:
+    # Fastest time of each stage per sampled log, over `repeats` passes over the sample
+    sample = [
+        synthetic_log(seed, players) for seed in range(min(count, _PER_LOG_SAMPLE))
+    ]
+    seconds = {
+        "strip_log_data": [float("inf")] * len(sample),
+        "transform_log": [float("inf")] * len(sample),
+    }
+    for _ in range(repeats):
+        for seed, raw_log in enumerate(sample):
+            # strip_log_data strips the log in place
+            log, strip_seconds = _timed(strip_log_data, copy.deepcopy(raw_log))
+            _, transform_seconds = _timed(transform_log, log, f"synthetic{seed}")
+            seconds["strip_log_data"][seed] = min(
+                seconds["strip_log_data"][seed], strip_seconds
+            )
+            seconds["transform_log"][seed] = min(
+                seconds["transform_log"][seed], transform_seconds
+            )
+    return seconds
+
+
+def _per_log_peaks(count: int, players: int) -> dict:
+    peaks = {"strip_log_data": 0, "transform_log": 0}
+    for seed in range(min(count, _PER_LOG_SAMPLE)):
+        log, peak = _traced(strip_log_data, synthetic_log(seed, players))
+        peaks["strip_log_data"] = max(peaks["strip_log_data"], peak)
+        _, peak = _traced(transform_log, log, f"synthetic{seed}")
+        peaks["transform_log"] = max(peaks["transform_log"], peak)
+    return peaks
+
+
+def _merge(frames: list):
+    # What fetch_data does with newly processed logs
+    df, _ = drop_duplicate_logs(merge_logs(frames))
+    return compact_frame(df)
+
+
+def _filter(df, version: str):
+    filter_index.clear()
+    filter_data.clear()
+    index = filter_index(version, df)
+    dates = index.dates
+    filters = InputParams(
+        "Default", "profession", [], [], [], dates, dates.min(), dates.max()
+    )
+    return index, filters, filter_data(index, filters)
+
+
+def _group_statistics(index, filters, df):
+    _group_partials.clear()
+    return group_statistics(index, filters, df)
+
+
+def run(sizes: list[int], players: int, repeats: int = REPEATS) -> dict:
+    # size -> stage -> {"seconds", "peak_bytes"}
+    frames = _process_logs(max(sizes), players)
+    seconds = _per_log_seconds(max(sizes), players, repeats)
+    peaks = _per_log_peaks(max(sizes), players)
+    results = {}
+    for size in sorted(sizes):
+        # Extrapolated from the median time per sampled log
+        result = {
+            stage: {
+                "seconds": size * statistics.median(seconds[stage][:size]),
+                "peak_bytes": peaks[stage],
+            }
+            for stage in seconds
+        }
+        df, result["merge"] = _measure(_merge, frames[:size], repeats=repeats)
+        version = _data_version(df)
+        (index, filters, filtered), result["filter_data"] = _measure(
+            _filter, df, version, repeats=repeats
+        )
+        _, result["group_statistics"] = _measure(
+            _group_statistics, index, filters, filtered, repeats=repeats
+        )
+        results[str(size)] = result
+        logging.info(f"Measured {size} logs.")
+    return results
+
+
+def regressions(
+    results: dict,
+    baseline: dict,
+    time_tolerance: float = TIME_TOLERANCE,
+    memory_tolerance: float = MEMORY_TOLERANCE,
+) -> list[str]:
+    # Sizes and stages that are missing in the baseline are not compared
+    found = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None:
+                continue
+            for key, tolerance, minimum in (
+                ("seconds", time_tolerance, _MIN_SECONDS),
+                ("peak_bytes", memory_tolerance, _MIN_PEAK_BYTES),
+            ):
+                if (
+                    result[key] > base[key] * (1 + tolerance)
+                    and result[key] - base[key] > minimum
+                ):
+                    found.append(
+                        f"{stage} with {size} logs: {key} {result[key]:.4g}"
+                        f" > {base[key]:.4g} (+{tolerance:.0%})"
+                    )
+    return found
+
+
+def _print_results(results: dict, baseline: dict):
+    print(f"{'logs':>6} {'stage':<18} {'seconds':>10} {'peak MB':>10} {'baseline':>18}")
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            base_string = (
+                f"{base['seconds']:.3f}s {base['peak_bytes'] / 1e6:.1f}MB"
+                if base
+                else "-"
+            )
+            print(
+                f"{size:>6} {stage:<18} {result['seconds']:>10.3f}"
+                f" {result['peak_bytes'] / 1e6:>10.1f} {base_string:>18}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the log processing pipeline on synthetic logs."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=SIZES,
+        help="Numbers of logs to benchmark.",
+    )
+    parser.add_argument(
+        "--players", type=int, default=50, help="Players per synthetic log."
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=REPEATS,
+        help="Runs of each stage, the fastest one is compared.",
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing them.",
+    )
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = run(args.sizes, args.players, args.repeats)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    _print_results(results, baseline)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(baseline | results, indent=2))
+        print(f"Saved the baseline to {args.baseline}.")
+        sys.exit()
+    if not baseline:
+        print(f"No baseline found at {args.baseline}, see --save-baseline.")
+        sys.exit()
+    found = regressions(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if found:
+        print("Regressions:", *found, sep="\n  ")
+        sys.exit(1)
+    print("No regressions.")
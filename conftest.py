@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from fetch_logs import drop_duplicate_logs, merge_logs
+from filter_logs import FilterIndex, InputParams
+from process_logs import compact_frame, strip_log_data, transform_log
+from synthetic_logs import synthetic_log
+
+# Synthetic data for the tests of the filters and aggregations
+
+
+@pytest.fixture(scope="session")
+def df() -> pd.DataFrame:
+    # Processed and merged like fetch_data does it
+    frames = [
+        transform_log(strip_log_data(synthetic_log(seed, 20)), f"log{seed}")
+        for seed in range(40)
+    ]
+    df, _ = drop_duplicate_logs(merge_logs(frames))
+    return compact_frame(df)
+
+
+def _filters(index: FilterIndex, group_by: str = "profession", **kwargs):
+    # No filters and all dates, unless given
+    dates = index.dates
+    values = {
+        "stat_category": "Default",
+        "group_by": group_by,
+        "account_name_filter": [],
+        "character_name_filter": [],
+        "profession_filter": [],
+        "dates": dates,
+        "start_time_min": dates.min(),
+        "start_time_max": dates.max(),
+    }
+    return InputParams(**(values | kwargs))
+
+
+@pytest.fixture
+def make_filters():
+    return _filters
@@ -1,133 +1,804 @@
+import hashlib
+import json
 import logging
+import os
 import queue
 import sys
 import threading
-from time import sleep
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from itertools import takewhile
+from typing import Callable, Dict, List
 
 import pandas as pd
 import requests
 import streamlit as st
-from requests.adapters import HTTPAdapter, Retry
-from streamlit.runtime.scriptrunner import add_script_run_ctx
 
-from process_logs import FightInvalidException, strip_log_data, transform_log
+from log_downloader import (
+    BACKOFF_FACTOR,
+    CPU_WORKER_COUNT,
+    RETRIES,
+    download_all,
+    is_permanent_error,
+    process_pool,
+)
+from log_store import (
+    decode_log,
+    has_log,
+    has_raw_log,
+    is_outdated,
+    is_rejected,
+    is_retry_due,
+    load_backfill_state,
+    load_log,
+    load_raw_log,
+    load_rebuilt_version,
+    load_rejections,
+    load_token_index,
+    load_upload_summary,
+    raw_log_ids,
+    save_backfill_state,
+    save_log,
+    save_raw_log,
+    save_rebuilt_version,
+    save_rejection,
+    save_token_index,
+    save_upload_summary,
+)
+from metrics import cached, count, observe_all, timed
+from process_logs import (
+    TRANSFORM_VERSION,
+    FightInvalidException,
+    LogParser,
+    compact_frame,
+    strip_log_data,
+    transform_log,
+)
 
-WORKER_COUNT = 4
-# XXX try to find a good balance...
-# from os import sched_getaffinity
-# WORKER_COUNT = len(sched_getaffinity(0))
-# import os
-# os.write(1, f"{WORKER_COUNT=}\n".encode())
-# Measured on wifi with 8 cores/16 threads
-# 2 -> 67
-# 4 -> 62
-# 8 -> 59
-# 16 -> 57
-# 32 -> 62
+# Can point to a local stand-in for load tests, see mock_dps_report.py
+BASE_URL = os.environ.get("DPS_REPORT_URL", "https://dps.report")
+MAX_PAGES = 5
+# Seconds until a getUploads request is given up (and retried)
+UPLOADS_TIMEOUT = 30
+# Logs of the selected window are fetched in the background, see `fetch_data`.
+# What was processed so far is merged at most every MERGE_INTERVAL seconds,
+# and merging takes at most 1 / MERGE_SLOWDOWN of the time as the frame grows.
+MERGE_INTERVAL = 2
+MERGE_SLOWDOWN = 4
+# Seconds until logs that could not be fetched are tried again (after their backoff)
+RETRY_INTERVAL = 300
+# Seconds between two pages of getUploads during a backfill, see `backfill_token`
+BACKFILL_PAGE_DELAY = 5
+# Pages of getUploads that one run of `backfill_token` processes at most
+BACKFILL_PAGES = 10
+# arcdps uses this species id for all WvW fights
+_WVW_BOSS_ID = 1
 
-BASE_URL = "https://dps.report"
 
+# log id -> future of the processed log while one caller fetches it,
+# shared with concurrent callers that need the same log (single flight)
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+# Tokens listed in DPS_REPORT_TOKENS are ingested by ingest.py instead of the app
+EXTERNAL_INGESTION = os.environ.get("GW2_EXTERNAL_INGESTION", "") not in ("", "0")
+
+
+def configured_tokens() -> Dict[str, str]:
+    # parse userTokens from env ("name1:token1,name2:token2")
+    userTokens = {}
+    if "DPS_REPORT_TOKENS" in os.environ:
+        for token in os.environ["DPS_REPORT_TOKENS"].split(","):
+            name, value = token.split(":")
+            userTokens |= {name: value.strip()}
+    return userTokens
+
+
+def _land(log_id: str, future: Future, log: pd.DataFrame | None):
+    with _in_flight_lock:
+        if _in_flight.get(log_id) is future:
+            del _in_flight[log_id]
+    if not future.done():
+        future.set_result(log)
+
+
+def _fetch_once(
+    log_ids: List[str],
+    fetch: Callable[[List[str], Callable[[str, pd.DataFrame | None], None]], None],
+    on_processed: Callable[[str, pd.DataFrame | None], None] | None,
+):
+    # Calls `fetch(log_ids, on_result)` only with the logs that nobody else fetches,
+    # e.g. for the window of another token with the same logs.
+    # The others are waited for and passed to `on_processed` afterwards.
+    own = {}
+    running = {}
+    with _in_flight_lock:
+        for log_id in log_ids:
+            if log_id in _in_flight:
+                running[_in_flight[log_id]] = log_id
+            else:
+                own[log_id] = _in_flight[log_id] = Future()
+    if running:
+        count("coalesced_logs", len(running))
+
+    def on_result(log_id: str, log: pd.DataFrame | None):
+        _land(log_id, own[log_id], log)
+        if on_processed:
+            on_processed(log_id, log)
 
-@st.cache_data(max_entries=500, show_spinner=False, persist=True)
-def _fetch_log_data(log_id: str, _session: requests.Session):
     try:
-        data_response = _session.get(f"{BASE_URL}/getJson?id={log_id}")
-        data_response.raise_for_status()
-    except Exception:
-        logging.exception(f"Could not download log {log_id}.")
-        return pd.DataFrame()
+        if own:
+            fetch(list(own), on_result)
+    finally:
+        # Logs without a result, e.g. after an exception, count as failed
+        for log_id, future in own.items():
+            _land(log_id, future, None)
+    for future in as_completed(running):
+        if on_processed:
+            on_processed(running[future], future.result())
+
+
+@dataclass
+class SyncState:
+    lock: threading.RLock = field(default_factory=threading.RLock)
+    # getUploads metadata of every known upload, including the skipped ones
+    uploads: Dict[str, dict] = field(default_factory=dict)
+    # uploads that are worth downloading, newest first, same as getUploads
+    log_ids: List[str] = field(default_factory=list)
+    # upload id -> reason it was skipped before downloading it
+    skipped: Dict[str, str] = field(default_factory=dict)
+    # the first upload of every fight, to recognize uploads of the same fight by others
+    fingerprints: Dict[tuple, str] = field(default_factory=dict)
+    # duplicate log id -> id of the log of the same fight that is used instead
+    duplicates: Dict[str, str] = field(default_factory=dict)
+    # logs that are part of `df` or were rejected and do not need to be fetched again
+    processed_ids: set = field(default_factory=set)
+    df: pd.DataFrame = field(default_factory=pd.DataFrame)
+    # identifies the content of `df`, see `_data_version`
+    version: str = ""
+    # bytes used by `df` before and after `compact_frame`
+    memory_usage: Dict[str, int] = field(default_factory=dict)
+    # logs of the selected window, see `fetch_data`
+    window: set = field(default_factory=set)
+    # background fetch of the missing logs of the window, None if not running
+    fetcher: threading.Thread | None = None
+    # processed and total logs of the running or last background fetch
+    progress: tuple[int, int] = (0, 0)
+    # log id -> time of the last attempt to fetch it, for logs that are not settled
+    attempts: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class FetchProgress:
+    processed: int
+    total: int
+    # of the logs that were merged so far, see `_data_version`
+    version: str
+
+
+@cached(st.cache_resource(show_spinner=False))
+def _sync_state(userToken: str) -> SyncState:
+    # Shared between all sessions and survives the ttl of the cached functions below
+    return SyncState()
+
+
+def _fetch_upload_page(userToken: str, page: int) -> dict:
+    # Retried like the log downloads, see log_downloader._download
+    url = f"{BASE_URL}/getUploads?userToken={userToken}&page={page}"
+    with timed("list fetch"):
+        for attempt in range(RETRIES + 1):
+            if attempt:
+                time.sleep(BACKOFF_FACTOR * 2 ** (attempt - 1))
+            try:
+                response = requests.get(url, timeout=UPLOADS_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == RETRIES:
+                    raise
+                continue
+            if attempt < RETRIES and (
+                response.status_code == 429 or response.status_code >= 500
+            ):
+                continue
+            response.raise_for_status()
+            return response.json()
+    raise RuntimeError("unreachable")
+
+
+def _upload_skip_reason(upload: dict) -> str | None:
+    # Reject uploads based on their getUploads metadata, so they are never downloaded.
+    # Missing metadata is never a reason to skip an upload.
+    encounter = upload.get("encounter") or {}
+    boss = encounter.get("boss") or ""
+    boss_ids = {encounter.get("bossId"), (upload.get("evtc") or {}).get("bossId")}
+    boss_ids.discard(None)
+    if (
+        boss_ids
+        and _WVW_BOSS_ID not in boss_ids
+        and "WvW" not in boss
+        and "World vs World" not in boss
+    ):
+        return "not a WvW fight"
+    if encounter.get("jsonAvailable") is False:
+        return "no json available"
+    if upload.get("players") == {}:
+        return "no players"
+    return None
+
+
+def _upload_fingerprint(upload: dict) -> tuple | None:
+    # Several squad members often upload the same fight with the same token.
+    # None if the metadata is incomplete, such uploads are never treated as duplicates.
+    duration = (upload.get("encounter") or {}).get("duration")
+    accounts = frozenset(
+        p.get("display_name") for p in (upload.get("players") or {}).values()
+    )
+    if not upload.get("encounterTime") or duration is None or not accounts:
+        return None
+    return upload["encounterTime"], duration, accounts
+
+
+def drop_duplicate_logs(df: pd.DataFrame) -> tuple[pd.DataFrame, Dict[str, str]]:
+    # Safety net for duplicates that were not recognized before downloading them:
+    # Keeps the first log of each fight (same start and accounts,
+    # the duration is not part of the processed logs).
+    # Returns the remaining rows and duplicate log id -> id of the kept log.
+    if df.empty:
+        return df, {}
+    logs = (
+        df.groupby("id", sort=False, observed=True)
+        .agg(timeStart=("timeStart", "first"), accounts=("account", frozenset))
+        .reset_index()
+    )
+    first_ids = logs.groupby(["timeStart", "accounts"], sort=False)["id"].transform(
+        "first"
+    )
+    duplicates = first_ids[logs["id"] != first_ids].set_axis(
+        logs["id"][logs["id"] != first_ids]
+    )
+    if duplicates.empty:
+        return df, {}
+    df = df[~df["id"].isin(duplicates.index)].reset_index(drop=True)
+    return df, duplicates.to_dict()
+
+
+def sync_log_list(userToken: str, state: SyncState) -> List[str]:
+    # The pages are fetched without holding the lock, so a slow dps.report
+    # does not block the sessions and the background fetch of this token.
+    # Concurrent syncs may fetch the same uploads, they are only registered once.
+    with state.lock:
+        if not state.uploads:
+            _load_stored_uploads(userToken, state)
+        known = set(state.uploads)
+    # Uploads are sorted newest first, so we can stop at the first upload we already know.
+    new_uploads = []
+    for page in range(1, MAX_PAGES + 1):
+        json = _fetch_upload_page(userToken, page)
+        unknown_uploads = list(
+            takewhile(lambda u: u["id"] not in known, json["uploads"])
+        )
+        new_uploads += unknown_uploads
+        if len(unknown_uploads) < len(json["uploads"]) or page >= json["pages"]:
+            break
+
+    with state.lock:
+        state.log_ids = _register_uploads(state, new_uploads) + state.log_ids
+        return list(state.log_ids)
+
+
+def _load_stored_uploads(userToken: str, state: SyncState):
+    # Continues from the uploads that ingest.py stored in earlier runs,
+    # so only the pages with newer uploads are fetched again.
+    # Only the encounterTime of their metadata is kept.
+    summary = load_upload_summary(userToken)
+    index = load_token_index(userToken)
+    state.uploads |= {i: {"id": i} for i in summary["skipped"]}
+    state.uploads |= {i: {"id": i, "encounterTime": t} for i, t in index.items()}
+    state.skipped |= summary["skipped"]
+    state.duplicates |= summary["duplicates"]
+    state.log_ids = list(index)
+
+
+def _save_upload_summary(userToken: str, state: SyncState):
+    summary = {"skipped": state.skipped, "duplicates": state.duplicates}
+    save_upload_summary(userToken, summary)
+
+
+def _register_uploads(state: SyncState, uploads: List[dict]) -> List[str]:
+    # Remembers the uploads and returns the ids of those that are worth downloading
+    new_ids = []
+    for upload in uploads:
+        if upload["id"] in state.uploads:
+            continue
+        state.uploads[upload["id"]] = upload
+        reason = _upload_skip_reason(upload)
+        if reason:
+            state.skipped[upload["id"]] = reason
+            continue
+        fingerprint = _upload_fingerprint(upload)
+        if fingerprint in state.fingerprints:
+            state.duplicates[upload["id"]] = state.fingerprints[fingerprint]
+            state.skipped[upload["id"]] = "duplicate fight"
+            continue
+        if fingerprint is not None:
+            state.fingerprints[fingerprint] = upload["id"]
+        new_ids.append(upload["id"])
+    return new_ids
+
+
+def _log_times(state: SyncState, log_ids: List[str]) -> Dict[str, float | None]:
+    return {i: state.uploads.get(i, {}).get("encounterTime") for i in log_ids}
+
+
+def _is_ingested(userToken: str) -> bool:
+    # Whether ingest.py fetches the logs of this token instead of the app
+    return EXTERNAL_INGESTION and userToken in configured_tokens().values()
+
+
+def skipped_uploads(userToken: str) -> Dict[str, int]:
+    # Number of skipped uploads by reason
+    if _is_ingested(userToken):
+        skipped = load_upload_summary(userToken)["skipped"]
+    else:
+        skipped = dict(_sync_state(userToken).skipped)
+    return dict(Counter(skipped.values()))
+
+
+def duplicate_logs(userToken: str) -> Dict[str, str]:
+    if _is_ingested(userToken):
+        return load_upload_summary(userToken)["duplicates"]
+    return dict(_sync_state(userToken).duplicates)
+
+
+@cached(st.cache_data(ttl=300))
+def _fetch_log_list(userToken: str) -> Dict[str, float | None]:
+    # log id -> encounterTime, newest first
+    if _is_ingested(userToken):
+        return load_token_index(userToken)
+    state = _sync_state(userToken)
+    return _log_times(state, sync_log_list(userToken, state))
+
+
+def log_dates(userToken: str) -> tuple[date, date] | None:
+    # First and last day with known logs
+    days = [
+        datetime.fromtimestamp(t).date()
+        for t in _fetch_log_list(userToken).values()
+        if t is not None
+    ]
+    return (min(days), max(days)) if days else None
+
+
+def _in_window(
+    log_time: float | None, first_day: date | None, last_day: date | None
+) -> bool:
+    # Logs without a known time are always included
+    if log_time is None:
+        return True
+    day = datetime.fromtimestamp(log_time).date()
+    return (first_day is None or first_day <= day) and (
+        last_day is None or day <= last_day
+    )
+
+
+def rejected_logs(userToken: str) -> pd.DataFrame:
+    return load_rejections(list(_fetch_log_list(userToken)))
+
+
+def _is_settled(log_id: str) -> bool:
+    # Logs that never have to be fetched again
+    return has_log(log_id) or is_rejected(log_id, permanent_only=True)
+
+
+def _transform_and_save(
+    log_id: str, log: dict, timings: Dict[str, float]
+) -> bytes | None:
     try:
-        return transform_log(strip_log_data(data_response.json()), log_id)
+        with timed("transform", timings):
+            df = transform_log(log, log_id)
     except FightInvalidException as e:
         logging.warning(e)
-        return pd.DataFrame()
+        save_rejection(
+            log_id, str(e), permanent=True, transform_version=TRANSFORM_VERSION
+        )
+        return None
+    with timed("store", timings):
+        return save_log(log_id, df)
 
 
-@st.cache_data(ttl=300)
-def _fetch_log_list(userToken: str):
-    response = requests.get(f"{BASE_URL}/getUploads?userToken={userToken}")
-    response.raise_for_status()
-    json = response.json()
-    max_pages = json["pages"]
-    uploads = json["uploads"]
-    for page in range(1, 5):
-        if page > max_pages:
-            break
-        response = requests.get(
-            f"{BASE_URL}/getUploads?userToken={userToken}&page={page+1}"
+def _parse_log_data(log_id: str, parser: LogParser) -> dict | None:
+    # Runs in the download threads, so only the stripped log is sent to the process pool
+    try:
+        with timed("parse"):
+            return parser.close()
+    except FightInvalidException as e:
+        logging.warning(e)
+        save_rejection(log_id, str(e), permanent=True)
+        return None
+
+
+def _process_log_data(log_id: str, log: dict) -> tuple[bytes | None, Dict[str, float]]:
+    # Runs in the process pool, so the result is returned as compact Arrow IPC buffer,
+    # together with the time of each stage (see `metrics.timed`)
+    timings = {}
+    with timed("archive", timings):
+        save_raw_log(log_id, log)
+    return _transform_and_save(log_id, log, timings), timings
+
+
+def _rebuild_log_data(log_id: str) -> tuple[bytes | None, Dict[str, float]]:
+    timings = {}
+    with timed("load archive", timings):
+        log = load_raw_log(log_id)
+    return _transform_and_save(log_id, log, timings), timings
+
+
+def _on_failed(log_id: str, e: Exception):
+    save_rejection(log_id, f"{type(e).__name__}: {e}", is_permanent_error(e))
+
+
+def download_logs(
+    log_ids: List[str],
+    on_processed: Callable[[str, pd.DataFrame | None], None] | None = None,
+    on_latency: Callable[[str, float], None] | None = None,
+):
+    # Downloads, processes and stores the logs in parallel.
+    # `on_processed` gets None for rejected logs and failed downloads,
+    # they are recorded in the negative cache of the log store instead.
+    # Logs that are already downloaded by another caller are only waited for,
+    # `on_latency` only gets the time of the others (see log_downloader.download_all).
+    def download(log_ids: List[str], on_log: Callable):
+        def on_result(log_id: str, result: tuple[bytes | None, dict] | None):
+            buffer = None
+            if result is not None:
+                buffer, timings = result
+                observe_all(timings)
+            on_log(log_id, decode_log(buffer) if buffer is not None else None)
+
+        # The logs are parsed while they are downloaded,
+        # only storing and transforming them runs in the process pool
+        download_all(
+            {log_id: f"{BASE_URL}/getJson?id={log_id}" for log_id in log_ids},
+            LogParser,
+            _parse_log_data,
+            _process_log_data,
+            on_result,
+            _on_failed,
+            pool=process_pool(),
+            on_latency=on_latency,
         )
-        response.raise_for_status()
-        uploads.extend(response.json()["uploads"])
-    return [upload["id"] for upload in uploads]
+
+    _fetch_once(log_ids, download, on_processed)
+
+
+def rebuild_logs(
+    log_ids: List[str],
+    on_processed: Callable[[str, pd.DataFrame | None], None] | None = None,
+):
+    # Processes the archived raw logs again in parallel, without any network access.
+    # Used for logs that were processed by an older TRANSFORM_VERSION.
+    def rebuild(log_ids: List[str], on_log: Callable):
+        pool = process_pool()
+        executor = pool or ThreadPoolExecutor(CPU_WORKER_COUNT)
+        try:
+            futures = {
+                executor.submit(_rebuild_log_data, log_id): log_id for log_id in log_ids
+            }
+            for future in as_completed(futures):
+                log_id = futures[future]
+                try:
+                    buffer, timings = future.result()
+                    observe_all(timings)
+                except Exception:
+                    logging.exception(f"Could not rebuild {log_id}.")
+                    buffer = None
+                on_log(log_id, decode_log(buffer) if buffer is not None else None)
+        finally:
+            if executor is not pool:
+                executor.shutdown()
+
+    _fetch_once(log_ids, rebuild, on_processed)
+
+
+def rebuild_outdated_logs() -> int:
+    # Rebuilds all archived logs that have no result of the current TRANSFORM_VERSION.
+    # The archive is only checked once per TRANSFORM_VERSION,
+    # logs that are archived later are processed by the same version right away.
+    if load_rebuilt_version() == TRANSFORM_VERSION:
+        return 0
+    outdated = [log_id for log_id in raw_log_ids() if is_outdated(log_id)]
+    rebuild_logs(outdated)
+    save_rebuilt_version(TRANSFORM_VERSION)
+    return len(outdated)
 
 
-def _fetch_log_worker(task_queue):
-    with requests.Session() as session:
-        session.mount(
-            BASE_URL, HTTPAdapter(max_retries=Retry(total=3, backoff_factor=1))
+def _merge_fetched(state: SyncState, logs: List[pd.DataFrame | None]):
+    # Adds processed logs to `state.df`, except those that left the window meanwhile.
+    # Merging takes a while for large frames, so it runs outside of the lock.
+    df = merge_logs(logs)
+    if df.empty:
+        return
+    with state.lock:
+        previous = state.df
+        df = df[df["id"].isin(state.window)]
+    if df.empty:
+        return
+    with timed("merge"):
+        merged, duplicates = drop_duplicate_logs(
+            pd.concat([previous, df])
+            .sort_values("timeStart", kind="stable")
+            .reset_index(drop=True)
         )
+    with timed("compact"):
+        merged, usage = _compact(merged)
+    with state.lock:
+        if state.df is not previous:
+            # The window was changed meanwhile, see `fetch_data`
+            merged = merged[merged["id"].isin(state.window)].reset_index(drop=True)
+        state.df = merged
+        state.duplicates |= duplicates
+        state.memory_usage = usage
+        state.version = _data_version(state.df)
+
+
+def _settle(state: SyncState, log_ids: List[str]):
+    # Failed downloads will be tried again after their backoff
+    settled = {i for i in log_ids if _is_settled(i)}
+    with state.lock:
+        state.processed_ids |= settled & state.window
+        for log_id in settled:
+            state.attempts.pop(log_id, None)
+
 
-        while True:
+def _merge_in_background(state: SyncState, processed: queue.SimpleQueue):
+    # Merges the queued (log id, log) pairs into `state.df` in batches until None is queued
+    batch = []
+    next_merge = time.monotonic() + MERGE_INTERVAL
+    finished = False
+    while not finished:
+        try:
+            # Without pending logs, the next one is merged right away
+            timeout = max(0.0, next_merge - time.monotonic()) if batch else None
+            item = processed.get(timeout=timeout)
+            if item is None:
+                finished = True
+            else:
+                batch.append(item)
+        except queue.Empty:
+            pass
+        if batch and (finished or time.monotonic() >= next_merge):
+            start = time.monotonic()
             try:
-                [log_buffer, index, log_id] = task_queue.get(timeout=3)
-            except queue.Empty:
-                return
-            log_buffer[index] = _fetch_log_data(log_id, session)
-            task_queue.task_done()
-
-
-def _fetch_logs(log_list):
-    log_count = len(log_list)
-    st.write("")
-    st.write("")
-    progress_bar = st.progress(0)
-
-    log_buffer = [pd.DataFrame()] * log_count
-    thread_list = []
-
-    # Create threads
-    task_queue = queue.Queue()
-    for _ in range(WORKER_COUNT):
-        thread = threading.Thread(
-            target=_fetch_log_worker, daemon=True, args=[task_queue]
-        )
-        thread = add_script_run_ctx(thread)
-        thread_list.append(thread)
-        thread.start()
-
-    # Distribute to workers
-    for index, log_id in enumerate(log_list):
-        task_queue.put([log_buffer, index, log_id])
-    while not task_queue.empty():
-        progress_bar.progress((log_count - task_queue.qsize()) / log_count)
-        sleep(1)
-    progress_bar.progress(100)
-    progress_bar.empty()
-
-    # Wait for results
-    with st.spinner(text="One more second..."):
-        task_queue.join()
-
-    # Merge buffer to a single Dataframe
-    df = pd.DataFrame()
-    for index, log in enumerate(log_buffer):
-        if not log.empty:
-            df = pd.concat([df, log])
+                _merge_fetched(state, [log for _, log in batch])
+                _settle(state, [log_id for log_id, _ in batch])
+            except Exception:
+                logging.exception("Could not merge the fetched logs.")
+            batch = []
+            elapsed = time.monotonic() - start
+            next_merge = time.monotonic() + max(
+                MERGE_INTERVAL, MERGE_SLOWDOWN * elapsed
+            )
+
+
+def _fetch_in_background(
+    state: SyncState,
+    log_ids: List[str],
+    download: bool,
+    on_latency: Callable[[str, float], None] | None,
+):
+    # Rebuilds or downloads the logs, while another thread merges them into `state.df`,
+    # so the app can show the logs processed so far.
+    # `on_processed` runs in the event loop of the downloader, so it must not merge itself.
+    processed = queue.SimpleQueue()
+    merger = threading.Thread(
+        target=_merge_in_background, args=(state, processed), daemon=True
+    )
+    merger.start()
+
+    def on_processed(log_id: str, log: pd.DataFrame | None):
+        processed.put((log_id, log))
+        # Only written by this thread, and replaced as a whole
+        state.progress = (state.progress[0] + 1, state.progress[1])
+
+    try:
+        rebuild_logs([i for i in log_ids if has_raw_log(i)], on_processed)
+        if download:
+            download_logs(
+                [i for i in log_ids if not has_raw_log(i)], on_processed, on_latency
+            )
+    except Exception:
+        logging.exception("Could not fetch the logs.")
+    finally:
+        processed.put(None)
+        merger.join()
+        with state.lock:
+            state.fetcher = None
+
+
+def merge_logs(logs: List[pd.DataFrame | None]) -> pd.DataFrame:
+    # Merge the processed logs to a single Dataframe, missing logs are None
+    logs = [log for log in logs if log is not None and not log.empty]
+    if not logs:
+        return pd.DataFrame()
+    df = pd.concat(logs)
 
     df = df.sort_values("timeStart").reset_index(drop=True)
     return df
 
 
-@st.cache_data(max_entries=6, ttl=310)
-def fetch_data(userToken: str):
-    log_list = _fetch_log_list(userToken)
+def ingest_token(userToken: str, state: SyncState):
+    # Headless version of `fetch_data` for ingest.py, only fills the log store.
+    # The logs of the token index were handled by earlier runs,
+    # those that failed are retried once their backoff has passed.
+    # This includes older pages that are not synced again (see `backfill_token`).
+    stored = load_token_index(userToken)
+    log_list = sync_log_list(userToken, state)
+    with state.lock:
+        missing = [
+            i
+            for i in log_list
+            if i not in stored and not has_log(i) and not is_rejected(i)
+        ]
+        missing += [i for i in stored if is_retry_due(i)]
+        rebuild_logs([i for i in missing if has_raw_log(i)])
+        download_logs([i for i in missing if not has_raw_log(i)])
+        _update_token_index(userToken, _log_times(state, log_list))
+        _save_upload_summary(userToken, state)
+
+
+def _update_token_index(
+    userToken: str, log_times: Dict[str, float | None], older: bool = False
+):
+    # Adds newer logs in front of the stored index and older ones behind it,
+    # so that logs from previous runs and the backfill are kept.
+    # With `older`, all of `log_times` are older than the stored logs.
+    index = load_token_index(userToken)
+    newer = [] if older else list(takewhile(lambda i: i not in index, log_times))
+    index = {i: log_times[i] for i in newer} | index
+    for i, log_time in log_times.items():
+        if log_time is not None or i not in index:
+            index[i] = log_time
+    save_token_index(userToken, index)
+
+
+def backfill_token(userToken: str, state: SyncState, max_pages: int = BACKFILL_PAGES):
+    # Walks all pages of getUploads (not only the newest MAX_PAGES) at a throttled rate.
+    # Every page is processed and stored before the next one is requested,
+    # so memory stays bounded and an interrupted backfill continues where it stopped.
+    # Stops after `max_pages`, the next run continues from there (0 for no limit).
+    backfill = load_backfill_state(userToken)
+    pages = 0
+    while not backfill["complete"] and (not max_pages or pages < max_pages):
+        pages += 1
+        json = _fetch_upload_page(userToken, backfill["page"])
+        with state.lock:
+            _register_uploads(state, json["uploads"])
+            log_ids = [
+                u["id"]
+                for u in json["uploads"]
+                if u["id"] in state.uploads
+                and not _upload_skip_reason(u)
+                and u["id"] not in state.duplicates
+            ]
+            missing = [i for i in log_ids if not has_log(i) and not is_rejected(i)]
+            rebuild_logs([i for i in missing if has_raw_log(i)])
+            download_logs([i for i in missing if not has_raw_log(i)])
+            _update_token_index(userToken, _log_times(state, log_ids), older=True)
+            _save_upload_summary(userToken, state)
+        logging.info(
+            f"Backfilled page {backfill['page']} of {json['pages']}"
+            f" ({len(missing)} new logs)."
+        )
+        if backfill["page"] >= json["pages"]:
+            backfill = {"page": 1, "complete": True}
+        else:
+            backfill["page"] += 1
+        save_backfill_state(userToken, backfill)
+        if not backfill["complete"] and pages != max_pages:
+            time.sleep(BACKFILL_PAGE_DELAY)
+
+
+def _compact(df: pd.DataFrame) -> tuple[pd.DataFrame, Dict[str, int]]:
+    # Returns the compacted frame and the bytes it used before and after
+    before = df.memory_usage(deep=True).sum()
+    df = compact_frame(df)
+    after = df.memory_usage(deep=True).sum()
+    logging.info(
+        f"Compacted {len(df)} rows from {before / 1e6:.1f}MB to {after / 1e6:.1f}MB."
+    )
+    return df, {"before compaction": int(before), "after": int(after)}
+
+
+def memory_usage(userToken: str) -> Dict[str, int]:
+    return dict(_sync_state(userToken).memory_usage)
+
+
+def _data_version(df: pd.DataFrame) -> str:
+    # The processed data only depends on the included logs and the TRANSFORM_VERSION,
+    # so this is stable across restarts and much cheaper than hashing the DataFrame.
+    log_ids = sorted(df["id"].unique()) if not df.empty else []
+    content = "\n".join([str(TRANSFORM_VERSION)] + log_ids)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def fetch_data(
+    userToken: str,
+    first_day: date | None = None,
+    last_day: date | None = None,
+    wait: bool = False,
+    on_latency: Callable[[str, float], None] | None = None,
+) -> tuple[pd.DataFrame, str]:
+    # Returns the processed logs between first_day and last_day (inclusive)
+    # and their version. Only this window is kept in memory.
+    # Stored logs are loaded right away, missing ones are fetched in the background
+    # and returned by later calls as they arrive, see `fetch_progress`.
+    # With `wait`, returns once the background fetch is finished.
+    # `on_latency` gets the time of every log that is downloaded by a background fetch
+    # started by this call, see `download_logs`.
+    log_list = [
+        i
+        for i, t in _fetch_log_list(userToken).items()
+        if _in_window(t, first_day, last_day)
+    ]
     # log_list = log_list[:10]  # XXX for testing
-    return _fetch_logs(log_list)
+    # Logs of tokens that are ingested by ingest.py are only read from the store
+    download = not _is_ingested(userToken)
+    state = _sync_state(userToken)
+    with state.lock:
+        if state.window != set(log_list):
+            state.window = set(log_list)
+            state.processed_ids &= state.window
+            if not state.df.empty and not state.df["id"].isin(state.window).all():
+                state.df = state.df[state.df["id"].isin(state.window)].reset_index(
+                    drop=True
+                )
+                state.version = _data_version(state.df)
+        # Only fetch logs that are not already part of the previous result
+        # and were not tried recently
+        now = time.monotonic()
+        new_log_list = [
+            i
+            for i in log_list
+            if i not in state.processed_ids
+            and now - state.attempts.get(i, -RETRY_INTERVAL) >= RETRY_INTERVAL
+        ]
+        if new_log_list and state.fetcher is None:
+            with timed("load stored logs"):
+                logs = {log_id: load_log(log_id) for log_id in new_log_list}
+            _merge_fetched(state, list(logs.values()))
+            state.attempts |= {i: now for i, log in logs.items() if log is None}
+            _settle(state, new_log_list)
+            missing = [
+                i for i, log in logs.items() if log is None and not is_rejected(i)
+            ]
+            if missing:
+                state.progress = (0, len(missing))
+                state.fetcher = threading.Thread(
+                    target=_fetch_in_background,
+                    args=(state, missing, download, on_latency),
+                    daemon=True,
+                )
+                state.fetcher.start()
+        fetcher = state.fetcher
+    if wait and fetcher is not None:
+        fetcher.join()
+    with state.lock:
+        return state.df, state.version
 
 
-if __name__ == "__main__":
-    import json
+def fetch_progress(userToken: str) -> FetchProgress | None:
+    # None if no logs are fetched in the background
+    state = _sync_state(userToken)
+    with state.lock:
+        if state.fetcher is None:
+            return None
+        return FetchProgress(*state.progress, state.version)
+
 
+if __name__ == "__main__":
     user_token = sys.argv[1]
 
     # log_list = _fetch_log_list(user_token)[11:14]
@@ -135,7 +806,7 @@ if __name__ == "__main__":
     #     log = requests.get(f"{BASE_URL}/getJson?id={log_id}").json()
     #     print(transform_log(filter_log_data(log), log_id))
 
-    log_ids = _fetch_log_list(user_token)
+    log_ids = list(_fetch_log_list(user_token))
     for log_id in log_ids[0:]:
         data_response = requests.get(f"{BASE_URL}/getJson?id={log_id}")
         data_response.raise_for_status()
@@ -1,10 +1,12 @@
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 from pandas.core.dtypes.dtypes import date
 
+from metrics import cached
 from process_logs import BOON_KEYS, RENAMED_KEYS
 
 
@@ -22,6 +24,20 @@ class InputParams:
     start_time_max: date
 
 
+@dataclass
+class FilterIndex:
+    # Everything that is needed to resolve InputParams, built once per dataset version
+    version: str
+    df: pd.DataFrame  # sorted by timeStart
+    time_start: pd.DatetimeIndex
+    dates: List[date]
+    # column -> per row position in the sorted unique values of the column
+    codes: Dict[str, np.ndarray]
+    categories: Dict[str, pd.Index]
+
+
+_INDEXED_COLUMNS = ["account", "name", "profession"]
+
 # These keys are needed but should not be selectable
 _HIDDEN_KEYS = [
     "id",
@@ -102,7 +118,47 @@ _KEY_CATEGORIES = {
 }
 
 
-def get_inputs(df: pd.DataFrame, tool_selector: str) -> InputParams:
+# The versions of a dataset change with every merge of a background fetch
+# (see fetch_logs._merge_fetched), so the caches below only keep a few entries,
+# otherwise they would mostly hold outdated copies of the data.
+@cached(st.cache_resource(max_entries=3, show_spinner=False))
+def filter_index(version: str, _df: pd.DataFrame) -> FilterIndex:
+    # `version` identifies the content of `_df`, which is too expensive to hash
+    df = _df
+    if not df["timeStart"].is_monotonic_increasing:
+        df = df.sort_values("timeStart", kind="stable").reset_index(drop=True)
+    codes = {}
+    categories = {}
+    for column in _INDEXED_COLUMNS:
+        codes[column], categories[column] = pd.factorize(df[column], sort=True)
+    return FilterIndex(
+        version,
+        df,
+        pd.DatetimeIndex(df["timeStart"]),
+        df["timeStart"].unique(),
+        codes,
+        categories,
+    )
+
+
+def _date_slider(label: str, key: str, dates, bound, **kwargs) -> date:
+    # Starts at `bound` and follows it as new dates arrive, unless it was moved
+    previous_bound = st.session_state.get(f"{key} bound")
+    selected = st.session_state.get(key)
+    if selected is None or selected == previous_bound or selected not in dates:
+        st.session_state[key] = bound
+    st.session_state[f"{key} bound"] = bound
+    format = "%d.%m. %H:%M"
+    return st.sidebar.select_slider(
+        label,
+        format_func=lambda t: pd.Timestamp(t).strftime(format),
+        options=dates,
+        key=key,
+        **kwargs,
+    )
+
+
+def get_inputs(index: FilterIndex, tool_selector: str) -> InputParams:
     stat_category_help = """
     Select which stats you are interested in:
 
@@ -160,30 +216,24 @@ def get_inputs(df: pd.DataFrame, tool_selector: str) -> InputParams:
         case _:
             group_by = "profession+name"
 
+    # While logs are fetched in the background the options grow with every rerun,
+    # the keys keep the selections of the filters across these reruns
     account_name_filter = st.sidebar.multiselect(
-        "Filter Account Names:", sorted(df.account.unique())
+        "Filter Account Names:", index.categories["account"], key="account filter"
     )
     character_name_filter = st.sidebar.multiselect(
-        "Filter Character Names:", sorted(df.name.unique())
+        "Filter Character Names:", index.categories["name"], key="name filter"
     )
     profession_filter = st.sidebar.multiselect(
-        "Filter Professions:", sorted(df.profession.unique())
+        "Filter Professions:", index.categories["profession"], key="profession filter"
     )
 
-    dates: List[date] = df["timeStart"].unique()
-    format = "%d.%m. %H:%M"
-    start_time_min: date = st.sidebar.select_slider(
-        "First + Last Date:",
-        format_func=lambda t: pd.Timestamp(t).strftime(format),
-        options=dates,
-        value=dates.min(),
+    dates = index.dates
+    start_time_min: date = _date_slider(
+        "First + Last Date:", "first date", dates, dates.min()
     )
-    start_time_max: date = st.sidebar.select_slider(
-        "hidden",
-        label_visibility="collapsed",
-        format_func=lambda t: pd.Timestamp(t).strftime(format),
-        options=dates,
-        value=dates.max(),
+    start_time_max: date = _date_slider(
+        "hidden", "last date", dates, dates.max(), label_visibility="collapsed"
     )
     if start_time_min > start_time_max:
         st.sidebar.error("First Date must be before Last Date")
@@ -201,15 +251,53 @@ def get_inputs(df: pd.DataFrame, tool_selector: str) -> InputParams:
     )
 
 
-@st.cache_data(max_entries=500, show_spinner=False, persist=True)
-def filter_data(df: pd.DataFrame, filters: InputParams):
-    df = df[df["timeStart"].between(filters.start_time_min, filters.start_time_max)]
+def _filter_key(filters: InputParams) -> tuple:
+    # `dates` only depends on the dataset, which is already part of the key,
+    # and `group_by` is not needed for filtering
+    return (
+        filters.stat_category,
+        tuple(filters.account_name_filter),
+        tuple(filters.character_name_filter),
+        tuple(filters.profession_filter),
+        pd.Timestamp(filters.start_time_min),
+        pd.Timestamp(filters.start_time_max),
+    )
+
+
+def _category_mask(
+    index: FilterIndex, column: str, values: List[str], rows: slice
+) -> np.ndarray:
+    # One flag per unique value, looked up by the codes of the rows.
+    # The additional last flag is for missing values (code -1).
+    allowed = np.zeros(len(index.categories[column]) + 1, dtype=bool)
+    positions = index.categories[column].get_indexer(values)
+    allowed[positions[positions >= 0]] = True
+    return allowed[index.codes[column][rows]]
+
+
+@cached(
+    st.cache_data(
+        max_entries=10,
+        show_spinner=False,
+        hash_funcs={FilterIndex: lambda index: index.version, InputParams: _filter_key},
+    )
+)
+def filter_data(index: FilterIndex, filters: InputParams):
+    # The rows are sorted by timeStart, so the time range is a single slice
+    rows = slice(
+        index.time_start.searchsorted(filters.start_time_min, side="left"),
+        index.time_start.searchsorted(filters.start_time_max, side="right"),
+    )
+    mask = np.ones(rows.stop - rows.start, dtype=bool)
     if filters.character_name_filter:
-        df = df[df["name"].isin(filters.character_name_filter)]
+        mask &= _category_mask(index, "name", filters.character_name_filter, rows)
     if filters.account_name_filter:
-        df = df[df["account"].isin(filters.account_name_filter)]
+        mask &= _category_mask(index, "account", filters.account_name_filter, rows)
     if filters.profession_filter:
-        df = df[df["profession"].isin(filters.profession_filter)]
+        mask &= _category_mask(index, "profession", filters.profession_filter, rows)
+    df = index.df.iloc[rows]
+    if not mask.all():
+        df = df[mask]
 
     # create inputs
     unlabeled_keys = [
@@ -35,9 +35,13 @@
 
       pythonEnv = pkgs.python3.withPackages (
         ps: with ps; [
+          aiohttp
           debugpy
+          ijson
           plotly
+          pyarrow
           streamlit
+          zstandard
         ]
       );
 
@@ -47,6 +51,12 @@
         text = "${pythonEnv}/bin/python3 -m streamlit run ${src}/app.py";
       };
 
+      ingestApp = pkgs.writeShellApplication {
+        name = "ingest";
+        runtimeInputs = [ pythonEnv ];
+        text = ''${pythonEnv}/bin/python3 ${src}/ingest.py "$@"'';
+      };
+
       devApp = pkgs.writeShellApplication {
         name = "streamlitRun";
         runtimeInputs = [ pythonEnv ];
@@ -64,6 +74,10 @@
           type = "app";
           program = "${devApp}/bin/streamlitRun";
         };
+        ingest = {
+          type = "app";
+          program = "${ingestApp}/bin/ingest";
+        };
       };
 
       devShells.${system} = {
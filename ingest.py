@@ -0,0 +1,97 @@
+import argparse
+import logging
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from fetch_logs import (
+    BACKFILL_PAGES,
+    SyncState,
+    backfill_token,
+    configured_tokens,
+    ingest_token,
+    rebuild_outdated_logs,
+)
+from metrics import counters, serve, timing_breakdown, write_metrics
+
+# Headless ingestion of all DPS_REPORT_TOKENS into the log store.
+# Run the app with GW2_EXTERNAL_INGESTION=1 so that it only reads those tokens from the store.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch and process the logs of all DPS_REPORT_TOKENS."
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=0,
+        help="Seconds between two runs. Runs only once if 0 (e.g. from a systemd timer).",
+    )
+    parser.add_argument(
+        "--rebuild-only",
+        action="store_true",
+        help="Only rebuild the archived logs of older processing versions, without network access.",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Also fetch all older uploads, not only the newest pages (throttled, resumable).",
+    )
+    parser.add_argument(
+        "--backfill-pages",
+        type=int,
+        default=BACKFILL_PAGES,
+        help="Pages of older uploads to backfill per token and run, so new logs are"
+        " not delayed by a long backfill. The next run continues. 0 for no limit.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help="Write the timings and counters in the Prometheus text format to this file"
+        " after every run, e.g. for the textfile collector of the node exporter.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Prometheus metrics on GW2_METRICS_ADDRESS:GW2_METRICS_PORT, if the port is set.
+    # Only useful with --interval, otherwise see --metrics-file.
+    serve()
+
+    # Logs of an older TRANSFORM_VERSION are rebuilt from the archive first
+    start = time.monotonic()
+    rebuilt = rebuild_outdated_logs()
+    if rebuilt:
+        logging.info(
+            f"Rebuilt {rebuilt} archived logs in {time.monotonic() - start:.1f}s."
+        )
+    if args.rebuild_only:
+        if args.metrics_file:
+            write_metrics(args.metrics_file)
+        sys.exit()
+
+    states = defaultdict(SyncState)
+    while True:
+        for name, token in configured_tokens().items():
+            start = time.monotonic()
+            try:
+                ingest_token(token, states[token])
+            except Exception:
+                logging.exception(f"Could not ingest the logs of {name}.")
+                continue
+            logging.info(
+                f"Ingested {name} in {time.monotonic() - start:.1f}s,"
+                f" skipped uploads: {dict(Counter(states[token].skipped.values()))}."
+            )
+        if args.backfill:
+            for name, token in configured_tokens().items():
+                try:
+                    backfill_token(token, states[token], args.backfill_pages)
+                except Exception:
+                    logging.exception(f"Could not backfill the logs of {name}.")
+        # Totals of all runs of this process
+        logging.info(f"Time spent per stage:\n{timing_breakdown().to_string()}")
+        logging.info(f"Counters: {counters()}")
+        if args.metrics_file:
+            write_metrics(args.metrics_file)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,130 @@
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import requests
+
+from metrics import timing_breakdown
+from mock_dps_report import PORT, add_config_arguments, config_from_arguments, serve
+
+# Measures the whole fetch pipeline of the app (getUploads, downloading, parsing,
+# processing and storing the logs) against a local mock_dps_report server,
+# with an empty log store so that every log is downloaded.
+_TOKEN = "load-test"
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float | None]:
+    # Same (nearest rank) percentiles as the /stats of the mock server
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float | None:
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    return {
+        "latency_p50": percentile(0.5),
+        "latency_p90": percentile(0.9),
+        "latency_p99": percentile(0.99),
+        "latency_max": latencies[-1] if latencies else None,
+    }
+
+
+def _wait_for(server: multiprocessing.Process, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while True:
+        if not server.is_alive():
+            raise RuntimeError(f"The mock server stopped ({server.exitcode=}).")
+        try:
+            requests.get(url, timeout=1).raise_for_status()
+            return
+        except requests.RequestException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch all logs from a local mock of dps.report and report the throughput."
+    )
+    parser.add_argument("--port", type=int, default=PORT)
+    add_config_arguments(parser)
+    parser.add_argument(
+        "--max-pages",
+        type=int,
+        help="Pages of getUploads to sync (MAX_PAGES), all pages by default.",
+    )
+    parser.add_argument("--retries", type=int, help="RETRIES of the downloader.")
+    parser.add_argument(
+        "--backoff-factor", type=float, help="BACKOFF_FACTOR of the downloader."
+    )
+    parser.add_argument(
+        "--process-count",
+        type=int,
+        help="Processes that process the logs (GW2_PROCESS_COUNT), 0 for threads.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    config = config_from_arguments(args)
+
+    url = f"http://localhost:{args.port}"
+    # The server runs in its own process, so it does not compete for the GIL
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(config, args.port), daemon=True
+    )
+    server.start()
+    with tempfile.TemporaryDirectory() as log_store_dir:
+        # Read on import, also by the spawned processes of the process pool
+        os.environ["DPS_REPORT_URL"] = url
+        os.environ["GW2_LOG_STORE_DIR"] = log_store_dir
+        if args.process_count is not None:
+            os.environ["GW2_PROCESS_COUNT"] = str(args.process_count)
+        import fetch_logs
+        import log_downloader
+
+        fetch_logs.MAX_PAGES = args.max_pages or math.ceil(
+            config.logs / config.per_page
+        )
+        if args.retries is not None:
+            log_downloader.RETRIES = args.retries
+        if args.backoff_factor is not None:
+            log_downloader.BACKOFF_FACTOR = args.backoff_factor
+
+        try:
+            _wait_for(server, f"{url}/stats")
+            start = time.monotonic()
+            # Client side latency of each log, from its first request until it is
+            # processed, so unlike the latency of the server it includes retries,
+            # waiting for the concurrency limit, reading, parsing and processing.
+            latencies = []
+            df, _ = fetch_logs.fetch_data(
+                _TOKEN,
+                wait=True,
+                on_latency=lambda log_id, seconds: latencies.append(seconds),
+            )
+            elapsed = time.monotonic() - start
+            stats = requests.get(f"{url}/stats").json()
+        finally:
+            server.terminate()
+        rejected = fetch_logs.rejected_logs(_TOKEN)
+
+    logs = df["id"].nunique() if not df.empty else 0
+    print(f"Fetched {logs} of {config.logs} logs in {elapsed:.1f}s")
+    print(f"  logs/s:    {logs / elapsed:.2f}")
+    print(f"  MB/s:      {stats['bytes_sent'] / elapsed / 1e6:.2f}")
+    print(f"  requests:  {stats['requests']} {stats['status']}")
+    print(f"  failed:    {len(rejected)}")
+    # Per log, client: request until processed, server: handling of the getJson request
+    for side, latency in [("client", _percentiles(latencies)), ("server", stats)]:
+        for key in ["latency_p50", "latency_p90", "latency_p99", "latency_max"]:
+            if latency[key] is not None:
+                print(f"  {side} {key}: {latency[key]:.3f}s")
+    print(timing_breakdown().to_string())
+    sys.exit(0 if logs == config.logs else 1)
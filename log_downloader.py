@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Protocol
+
+import aiohttp
+
+from metrics import count, observe
+
+# Concurrent downloads are adjusted between these values (AIMD),
+# depending on the observed latency and error rate.
+MIN_CONCURRENCY = 1
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 32
+# Time to first byte may grow to this multiple of the fastest observed one
+# before it counts as congestion.
+LATENCY_TOLERANCE = 3
+RETRIES = 3
+BACKOFF_FACTOR = 1
+# Processing the downloaded logs is CPU bound, so there is no point in using more workers than cores.
+CPU_WORKER_COUNT = (
+    len(os.sched_getaffinity(0))
+    if hasattr(os, "sched_getaffinity")
+    else os.cpu_count() or 1
+)
+
+# Number of processes that process the parsed logs, so that they are not limited by the GIL.
+# 0 processes the logs in threads of the streamlit process instead.
+# Every process takes about 150MB after its imports, so only a few are used by default.
+DEFAULT_PROCESS_COUNT = 2
+PROCESS_COUNT = int(
+    os.environ.get(
+        "GW2_PROCESS_COUNT",
+        min(DEFAULT_PROCESS_COUNT, CPU_WORKER_COUNT) if CPU_WORKER_COUNT > 1 else 0,
+    )
+)
+CHUNK_SIZE = 256 * 1024
+
+_TIMEOUT = aiohttp.ClientTimeout(total=300, sock_connect=30)
+
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_lock = threading.Lock()
+
+
+class Parser(Protocol):
+    # Consumes the response body while it is being downloaded.
+    # Setting `done` stops the download early.
+    done: bool
+
+    def feed(self, chunk: bytes): ...
+
+
+class AdaptiveLimiter:
+    # Additive increase, multiplicative decrease:
+    # Every successful download grows the limit by 1/limit (so roughly +1 per round trip),
+    # errors and latency spikes halve it.
+    def __init__(
+        self,
+        initial: int = INITIAL_CONCURRENCY,
+        minimum: int = MIN_CONCURRENCY,
+        maximum: int = MAX_CONCURRENCY,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.min_latency = float("inf")
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> float:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, start: float, latency: float | None):
+        # `latency` is None if the request failed in a way that hints at an overloaded server.
+        async with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self.min_latency = min(self.min_latency, latency)
+            congested = (
+                latency is None or latency > LATENCY_TOLERANCE * self.min_latency
+            )
+            if not congested:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif start > self._last_decrease:
+                # Requests that were started before the last decrease
+                # still saw the old limit, so only react once per round trip.
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = time.monotonic()
+            self._condition.notify_all()
+
+
+async def _download(
+    session: aiohttp.ClientSession,
+    limiter: AdaptiveLimiter,
+    cpu_pool: ThreadPoolExecutor,
+    url: str,
+    parser_factory: Callable[[], Parser],
+) -> Parser:
+    loop = asyncio.get_running_loop()
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(BACKOFF_FACTOR * 2 ** (attempt - 1))
+        start = await limiter.acquire()
+        latency = None
+        try:
+            async with session.get(url) as response:
+                if response.status == 429 or response.status >= 500:
+                    if attempt == RETRIES:
+                        response.raise_for_status()
+                    continue
+                latency = time.monotonic() - start
+                response.raise_for_status()
+                # Parsing is CPU bound, so it runs on the cpu pool.
+                # A busy pool slows down reading, so the body never piles up in memory.
+                parser = parser_factory()
+                size = 0
+                parse_seconds = 0.0
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    parse_start = time.monotonic()
+                    await loop.run_in_executor(cpu_pool, parser.feed, chunk)
+                    parse_seconds += time.monotonic() - parse_start
+                    if parser.done:
+                        break
+                # The download time includes waiting for the parser
+                observe("download", time.monotonic() - start)
+                observe("parse while downloading", parse_seconds)
+                count("download_bytes", size)
+                return parser
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == RETRIES:
+                raise
+        finally:
+            await limiter.release(start, latency)
+    raise RuntimeError("unreachable")
+
+
+def is_permanent_error(e: Exception) -> bool:
+    # Client errors will not go away by retrying, except for timeouts and rate limits
+    return (
+        isinstance(e, aiohttp.ClientResponseError)
+        and 400 <= e.status < 500
+        and e.status not in (408, 429)
+    )
+
+
+def _disable_process_pool():
+    global _process_pool, PROCESS_COUNT
+    with _process_pool_lock:
+        PROCESS_COUNT = 0
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def process_pool() -> ProcessPoolExecutor | None:
+    # Shared pool for the CPU bound processing of downloaded logs.
+    # None if disabled, the logs are then processed by threads of this process.
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None and PROCESS_COUNT > 0:
+            # Forking a process that runs the streamlit server threads is not safe
+            _process_pool = ProcessPoolExecutor(
+                PROCESS_COUNT, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+async def _download_all(
+    urls: Dict[str, str],
+    parser_factory: Callable[[], Parser],
+    parse: Callable[[str, Parser], Any],
+    process: Callable[[str, Any], Any],
+    on_processed: Callable[[str, Any], None],
+    on_failed: Callable[[str, Exception], None] | None,
+    cpu_workers: int,
+    pool: Executor | None,
+    on_latency: Callable[[str, float], None] | None,
+):
+    limiter = AdaptiveLimiter()
+    # Limits the number of parsed logs that are waiting to be processed,
+    # so a slow CPU does not lead to all logs being held in memory.
+    pending = asyncio.Semaphore(MAX_CONCURRENCY + 2 * cpu_workers)
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(cpu_workers) as cpu_pool:
+
+        async def run_process(key: str, parser: Parser):
+            nonlocal pool
+            # Only the (much smaller) parsed result is sent to the process pool
+            parsed = await loop.run_in_executor(cpu_pool, parse, key, parser)
+            if parsed is None:
+                return None
+            if pool is not None:
+                try:
+                    return await loop.run_in_executor(pool, process, key, parsed)
+                except BrokenProcessPool:
+                    logging.exception("Process pool broke, processing logs in threads.")
+                    _disable_process_pool()
+                    pool = None
+            return await loop.run_in_executor(cpu_pool, process, key, parsed)
+
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_CONCURRENCY), timeout=_TIMEOUT
+        ) as session:
+
+            async def handle(key: str, url: str):
+                result = None
+                async with pending:
+                    start = time.monotonic()
+                    try:
+                        parser = await _download(
+                            session, limiter, cpu_pool, url, parser_factory
+                        )
+                        result = await run_process(key, parser)
+                    except Exception as e:
+                        logging.exception(f"Could not fetch {url}.")
+                        if on_failed:
+                            on_failed(key, e)
+                on_processed(key, result)
+                if on_latency:
+                    on_latency(key, time.monotonic() - start)
+
+            await asyncio.gather(*(handle(key, url) for key, url in urls.items()))
+
+
+def download_all(
+    urls: Dict[str, str],
+    parser_factory: Callable[[], Parser],
+    parse: Callable[[str, Parser], Any],
+    process: Callable[[str, Any], Any],
+    on_processed: Callable[[str, Any], None],
+    on_failed: Callable[[str, Exception], None] | None = None,
+    cpu_workers: int = CPU_WORKER_COUNT,
+    pool: Executor | None = None,
+    on_latency: Callable[[str, float], None] | None = None,
+):
+    # Downloads all `urls` (key -> url) over one connection pool and feeds each body
+    # into a new parser on a pool of `cpu_workers` threads.
+    # `parse(key, parser)` finishes the parser on the same threads once the body is complete.
+    # `process(key, parsed)` then runs on `pool` if given, otherwise on the same threads,
+    # so it and its arguments have to be picklable when `pool` is a process pool.
+    # It is skipped if `parse` returned None.
+    # `on_processed(key, result)` is called from the calling thread with the result
+    # of `process`, or with None if downloading, parsing or processing failed.
+    # In that case `on_failed(key, exception)` is called before.
+    # `on_latency(key, seconds)` gets the time from the first request of each url
+    # until `on_processed` returned, including retries, parsing and processing.
+    asyncio.run(
+        _download_all(
+            urls,
+            parser_factory,
+            parse,
+            process,
+            on_processed,
+            on_failed,
+            cpu_workers,
+            pool,
+            on_latency,
+        )
+    )
@@ -0,0 +1,252 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import zstandard
+
+from process_logs import TRANSFORM_VERSION
+
+# One uncompressed Arrow IPC (feather v2) file per processed log.
+# Uncompressed so that reading can memory map the file instead of decoding it.
+LOG_STORE_DIR = Path(os.environ.get("GW2_LOG_STORE_DIR", "log_store"))
+# The stripped JSON of every downloaded log is archived as well (zstd compressed),
+# so that processed logs can be rebuilt without downloading them again.
+# Every processed log stores the TRANSFORM_VERSION it was built with.
+_VERSION_KEY = b"transform_version"
+# Logs that failed temporarily are retried after this many seconds,
+# doubling with every further failure up to the maximum.
+RETRY_BACKOFF = 10 * 60
+MAX_RETRY_BACKOFF = 7 * 24 * 60 * 60
+
+
+def _token_index_path(userToken: str) -> Path:
+    # Tokens are secrets, so they do not end up in file names
+    return (
+        LOG_STORE_DIR
+        / "tokens"
+        / f"{hashlib.sha256(userToken.encode()).hexdigest()}.json"
+    )
+
+
+def _log_path(log_id: str) -> Path:
+    return LOG_STORE_DIR / f"{log_id}.arrow"
+
+
+def _raw_log_path(log_id: str) -> Path:
+    return LOG_STORE_DIR / "raw" / f"{log_id}.json.zst"
+
+
+def _rejection_path(log_id: str) -> Path:
+    return LOG_STORE_DIR / "rejected" / f"{log_id}.json"
+
+
+def _read_table(path: Path) -> pa.Table | None:
+    # None if the log is missing or was built by another TRANSFORM_VERSION
+    if not path.exists():
+        return None
+    table = feather.read_table(path, memory_map=True)
+    # Logs stored before versioning was introduced are version 1
+    version = (table.schema.metadata or {}).get(_VERSION_KEY, b"1")
+    if int(version) != TRANSFORM_VERSION:
+        return None
+    return table
+
+
+def has_log(log_id: str) -> bool:
+    return _read_table(_log_path(log_id)) is not None
+
+
+def load_log(log_id: str) -> pd.DataFrame | None:
+    table = _read_table(_log_path(log_id))
+    return table.to_pandas() if table is not None else None
+
+
+def encode_log(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df.reset_index(drop=True))
+    table = table.replace_schema_metadata(
+        (table.schema.metadata or {}) | {_VERSION_KEY: str(TRANSFORM_VERSION).encode()}
+    )
+    buffer = io.BytesIO()
+    feather.write_feather(table, buffer, compression="uncompressed")
+    return buffer.getvalue()
+
+
+def decode_log(buffer: bytes) -> pd.DataFrame:
+    return feather.read_table(pa.BufferReader(buffer)).to_pandas()
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, so that concurrent readers never see half a file.
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def save_log(log_id: str, df: pd.DataFrame) -> bytes:
+    # Returns the stored Arrow IPC buffer, see `decode_log`.
+    buffer = encode_log(df)
+    _write_atomic(_log_path(log_id), buffer)
+    _rejection_path(log_id).unlink(missing_ok=True)
+    return buffer
+
+
+def has_raw_log(log_id: str) -> bool:
+    return _raw_log_path(log_id).exists()
+
+
+def load_raw_log(log_id: str) -> dict | None:
+    path = _raw_log_path(log_id)
+    if not path.exists():
+        return None
+    return json.loads(zstandard.decompress(path.read_bytes()))
+
+
+def save_raw_log(log_id: str, log: dict):
+    # `log` is the stripped log, see `process_logs.strip_log_data`
+    _write_atomic(_raw_log_path(log_id), zstandard.compress(json.dumps(log).encode()))
+
+
+def load_rebuilt_version() -> int | None:
+    # TRANSFORM_VERSION that all archived logs were last rebuilt with
+    path = LOG_STORE_DIR / "raw" / "rebuilt.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())["transform_version"]
+
+
+def save_rebuilt_version(version: int):
+    data = json.dumps({"transform_version": version}).encode()
+    _write_atomic(LOG_STORE_DIR / "raw" / "rebuilt.json", data)
+
+
+def raw_log_ids() -> list[str]:
+    return [
+        path.name.removesuffix(".json.zst")
+        for path in (LOG_STORE_DIR / "raw").glob("*.json.zst")
+    ]
+
+
+def load_rejection(log_id: str) -> dict | None:
+    path = _rejection_path(log_id)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def save_rejection(
+    log_id: str, reason: str, permanent: bool, transform_version: int | None = None
+):
+    # Permanently rejected logs are never fetched again,
+    # the others are retried with exponential backoff.
+    # Logs rejected by `transform_log` record its version, see `is_outdated`.
+    previous = load_rejection(log_id) or {}
+    failures = previous.get("failures", 0) + 1
+    backoff = min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** (failures - 1))
+    rejection = {
+        "reason": reason,
+        "permanent": permanent,
+        "failures": failures,
+        "retry_at": None if permanent else time.time() + backoff,
+        "transform_version": transform_version,
+    }
+    _write_atomic(_rejection_path(log_id), json.dumps(rejection).encode())
+
+
+def is_rejected(log_id: str, permanent_only: bool = False) -> bool:
+    # Whether the log should not be fetched (now)
+    rejection = load_rejection(log_id)
+    if rejection is None:
+        return False
+    if rejection["permanent"]:
+        # unless the archived log can be processed again by a newer transform
+        return rejection.get("transform_version") in (None, TRANSFORM_VERSION)
+    return not permanent_only and time.time() < rejection["retry_at"]
+
+
+def is_retry_due(log_id: str) -> bool:
+    # Whether the log failed before (not permanently) and its backoff has passed
+    rejection = load_rejection(log_id)
+    return (
+        rejection is not None
+        and not rejection["permanent"]
+        and time.time() >= rejection["retry_at"]
+    )
+
+
+def is_outdated(log_id: str) -> bool:
+    # Whether the archived raw log has to be processed (again) by the current transform
+    if has_log(log_id):
+        return False
+    rejection = load_rejection(log_id)
+    return rejection is None or rejection.get("transform_version") != TRANSFORM_VERSION
+
+
+def load_rejections(log_ids: list[str]) -> pd.DataFrame:
+    rejections = {
+        log_id: rejection
+        for log_id in log_ids
+        if (rejection := load_rejection(log_id)) is not None
+    }
+    df = pd.DataFrame.from_dict(
+        rejections,
+        orient="index",
+        columns=["reason", "permanent", "failures", "retry_at", "transform_version"],
+    )
+    df["retry_at"] = pd.to_datetime(df["retry_at"], unit="s")
+    return df
+
+
+def load_token_index(userToken: str) -> dict[str, float | None]:
+    # Ids of all logs uploaded with this token, newest first,
+    # with their encounterTime (unix seconds) if known
+    path = _token_index_path(userToken)
+    if not path.exists():
+        return {}
+    index = json.loads(path.read_text())
+    # Older indexes only contain the ids
+    return dict.fromkeys(index) if isinstance(index, list) else index
+
+
+def save_token_index(userToken: str, log_times: dict[str, float | None]):
+    _write_atomic(_token_index_path(userToken), json.dumps(log_times).encode())
+
+
+def _upload_summary_path(userToken: str) -> Path:
+    return _token_index_path(userToken).with_suffix(".uploads.json")
+
+
+def load_upload_summary(userToken: str) -> dict:
+    # Uploads that were not downloaded: skipped upload id -> reason
+    # and duplicate log id -> id of the log of the same fight that is used instead
+    path = _upload_summary_path(userToken)
+    if not path.exists():
+        return {"skipped": {}, "duplicates": {}}
+    return json.loads(path.read_text())
+
+
+def save_upload_summary(userToken: str, summary: dict):
+    _write_atomic(_upload_summary_path(userToken), json.dumps(summary).encode())
+
+
+def _backfill_path(userToken: str) -> Path:
+    return _token_index_path(userToken).with_suffix(".backfill.json")
+
+
+def load_backfill_state(userToken: str) -> dict:
+    # Next page of getUploads to backfill and whether all pages were walked once
+    path = _backfill_path(userToken)
+    if not path.exists():
+        return {"page": 1, "complete": False}
+    return json.loads(path.read_text())
+
+
+def save_backfill_state(userToken: str, state: dict):
+    _write_atomic(_backfill_path(userToken), json.dumps(state).encode())
@@ -0,0 +1,208 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict
+
+import pandas as pd
+
+# Timings of the pipeline stages and counters of this process,
+# shown in the debug view of the app and exported in the Prometheus text format.
+# Serves /metrics on this port if set, see `serve`.
+# Only on localhost by default, set the address to e.g. 0.0.0.0 for a remote Prometheus.
+METRICS_PORT = int(os.environ.get("GW2_METRICS_PORT", 0))
+METRICS_ADDRESS = os.environ.get("GW2_METRICS_ADDRESS", "127.0.0.1")
+_PREFIX = "gw2_stats_tracker"
+
+
+@dataclass
+class _Summary:
+    count: int = 0
+    total: float = 0.0
+    maximum: float = 0.0
+
+
+_lock = threading.Lock()
+_timings: Dict[str, _Summary] = defaultdict(_Summary)
+# (name, labels) -> value, labels as sorted tuple of (key, value)
+_counters: Dict[tuple, float] = defaultdict(float)
+_serving = False
+
+
+def observe(stage: str, seconds: float):
+    with _lock:
+        summary = _timings[stage]
+        summary.count += 1
+        summary.total += seconds
+        summary.maximum = max(summary.maximum, seconds)
+
+
+def observe_all(timings: Dict[str, float]):
+    # For timings that were collected in another process, see `timed`
+    for stage, seconds in timings.items():
+        observe(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str, into: Dict[str, float] | None = None):
+    # Records the duration of the block, or adds it to `into` if given.
+    # The latter is used in the process pool, whose results are sent back
+    # to this process and passed to `observe_all`.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if into is None:
+            observe(stage, seconds)
+        else:
+            into[stage] = into.get(stage, 0.0) + seconds
+
+
+def count(name: str, amount: float = 1, **labels: str):
+    with _lock:
+        _counters[name, tuple(sorted(labels.items()))] += amount
+
+
+def cached(cache_decorator: Callable) -> Callable:
+    # Applies a streamlit cache decorator and counts the calls and the misses
+    # (calls that actually ran the function) of the cached function, e.g.
+    # @cached(st.cache_data(ttl=300))
+    def decorate(function: Callable) -> Callable:
+        name = function.__name__
+
+        @functools.wraps(function)
+        def compute(*args, **kwargs):
+            count("cache_misses", function=name)
+            return function(*args, **kwargs)
+
+        cached_function = cache_decorator(compute)
+
+        @functools.wraps(function)
+        def call(*args, **kwargs):
+            count("cache_calls", function=name)
+            return cached_function(*args, **kwargs)
+
+        call.clear = cached_function.clear
+        return call
+
+    return decorate
+
+
+def timing_breakdown() -> pd.DataFrame:
+    with _lock:
+        rows = {
+            stage: (s.count, s.total, s.total / s.count, s.maximum)
+            for stage, s in _timings.items()
+        }
+    df = pd.DataFrame.from_dict(
+        rows, orient="index", columns=["count", "total (s)", "mean (s)", "max (s)"]
+    )
+    return df.sort_values("total (s)", ascending=False)
+
+
+def cache_statistics() -> pd.DataFrame:
+    with _lock:
+        counters = dict(_counters)
+    rows = defaultdict(lambda: {"calls": 0, "misses": 0})
+    for (name, labels), value in counters.items():
+        if name in ("cache_calls", "cache_misses"):
+            rows[dict(labels)["function"]][name.removeprefix("cache_")] = int(value)
+    df = pd.DataFrame.from_dict(rows, orient="index", columns=["calls", "misses"])
+    df["hits"] = df["calls"] - df["misses"]
+    return df.sort_index()
+
+
+def counters() -> Dict[str, float]:
+    # All counters without labels, like the downloaded bytes
+    with _lock:
+        return {
+            name: value for (name, labels), value in _counters.items() if not labels
+        }
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def prometheus_text() -> str:
+    # https://prometheus.io/docs/instrumenting/exposition_formats/
+    with _lock:
+        timings = {stage: _Summary(**vars(s)) for stage, s in _timings.items()}
+        counter_values = dict(_counters)
+
+    lines = [
+        f"# HELP {_PREFIX}_stage_seconds Time spent in each stage of the pipeline.",
+        f"# TYPE {_PREFIX}_stage_seconds summary",
+    ]
+    for stage, summary in sorted(timings.items()):
+        labels = _labels((("stage", stage),))
+        lines += [
+            f"{_PREFIX}_stage_seconds_count{labels} {summary.count}",
+            f"{_PREFIX}_stage_seconds_sum{labels} {summary.total}",
+        ]
+    lines += [f"# TYPE {_PREFIX}_stage_seconds_max gauge"]
+    for stage, summary in sorted(timings.items()):
+        labels = _labels((("stage", stage),))
+        lines += [f"{_PREFIX}_stage_seconds_max{labels} {summary.maximum}"]
+
+    names = sorted({name for name, _ in counter_values})
+    for name in names:
+        lines += [f"# TYPE {_PREFIX}_{name}_total counter"]
+        for (counter, labels), value in sorted(counter_values.items()):
+            if counter == name:
+                lines += [f"{_PREFIX}_{name}_total{_labels(labels)} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: Path):
+    # For processes that do not live long enough to be scraped, like ingest.py on a timer.
+    # The textfile collector of the Prometheus node exporter exports the file instead.
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a log line each
+        pass
+
+
+def serve(port: int = METRICS_PORT, address: str = METRICS_ADDRESS):
+    # Serves /metrics for Prometheus in a background thread, once per process.
+    # Does nothing if the port is 0.
+    global _serving
+    with _lock:
+        if _serving or not port:
+            return
+        _serving = True
+    try:
+        server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    except OSError:
+        logging.exception(f"Could not serve the metrics on {address}:{port}.")
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
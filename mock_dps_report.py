@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from aiohttp import web
+
+from synthetic_logs import format_time, log_start, synthetic_log
+
+# Local stand-in for the parts of the dps.report API that fetch_logs uses,
+# serving synthetic logs (see synthetic_logs.py) with configurable latency,
+# bandwidth and errors. Point the app at it with DPS_REPORT_URL=http://localhost:8765,
+# or use load_test.py to measure the whole fetch pipeline against it.
+PORT = 8765
+CHUNK_SIZE = 64 * 1024
+# Logs are served from this many pre-encoded variants with their own start time,
+# so serving them costs (almost) no CPU that the measured client could use.
+_VARIANTS = 16
+
+
+@dataclass
+class MockConfig:
+    logs: int = 500
+    per_page: int = 100
+    players: int = 50
+    # seconds until the headers of a response are sent, +- jitter (share of latency)
+    latency: float = 0.05
+    jitter: float = 0.5
+    # bytes per second of each getJson response, unlimited if None
+    bandwidth: float | None = None
+    # share of getUploads and getJson requests that are answered with 429 and 5xx respectively
+    rate_limit_rate: float = 0.0
+    server_error_rate: float = 0.0
+    seed: int = 0
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    bytes_sent: int = 0
+    status: dict = field(default_factory=dict)
+    # seconds from receiving to completing each successful getJson request
+    latencies: list = field(default_factory=list)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float | None:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "status": self.status,
+            "latency_p50": percentile(0.5),
+            "latency_p90": percentile(0.9),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+
+def log_id(seed: int) -> str:
+    return f"mock{seed:06d}"
+
+
+class MockServer:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.stats = MockStats()
+        self._random = random.Random(config.seed)
+        self._templates = []
+        for variant in range(_VARIANTS):
+            log = synthetic_log(variant, config.players)
+            self._templates.append(
+                (
+                    json.dumps(log).encode(),
+                    log["timeStart"].encode(),
+                    log["timeEnd"].encode(),
+                    log["durationMS"],
+                )
+            )
+
+    def upload(self, seed: int) -> dict:
+        # getUploads metadata of the log, see _upload_skip_reason and _upload_fingerprint
+        start = log_start(seed)
+        return {
+            "id": log_id(seed),
+            "permalink": f"https://dps.report/{log_id(seed)}",
+            "uploadTime": int(start.timestamp()) + 3600,
+            "encounterTime": int(start.timestamp()),
+            "encounter": {
+                "bossId": 1,
+                "boss": "World vs World",
+                "duration": self._templates[seed % _VARIANTS][3] // 1000,
+                "jsonAvailable": True,
+            },
+            "players": {f"Uploader {seed}": {"display_name": f"Uploader.{seed}"}},
+        }
+
+    def payload(self, seed: int) -> bytes:
+        data, time_start, time_end, duration_ms = self._templates[seed % _VARIANTS]
+        start = log_start(seed)
+        end = start + timedelta(milliseconds=duration_ms)
+        return data.replace(time_start, format_time(start).encode(), 1).replace(
+            time_end, format_time(end).encode(), 1
+        )
+
+    async def _delay(self):
+        latency = self.config.latency * (
+            1 + self.config.jitter * self._random.uniform(-1, 1)
+        )
+        await asyncio.sleep(max(0.0, latency))
+
+    def _count(self, status: int):
+        self.stats.requests += 1
+        self.stats.status[status] = self.stats.status.get(status, 0) + 1
+
+    def _error(self) -> web.Response | None:
+        # An injected error response, see rate_limit_rate and server_error_rate
+        error = self._random.random()
+        if error < self.config.rate_limit_rate:
+            self._count(429)
+            return web.json_response({"error": "Rate limited"}, status=429)
+        if error < self.config.rate_limit_rate + self.config.server_error_rate:
+            self._count(503)
+            return web.json_response({"error": "Unavailable"}, status=503)
+        return None
+
+    async def get_uploads(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if error := self._error():
+            return error
+        page = int(request.query.get("page", 1))
+        pages = max(1, math.ceil(self.config.logs / self.config.per_page))
+        # newest first
+        newest = self.config.logs - 1 - (page - 1) * self.config.per_page
+        seeds = range(newest, max(-1, newest - self.config.per_page), -1)
+        body = {
+            "pages": pages,
+            "totalUploads": self.config.logs,
+            "userToken": request.query.get("userToken"),
+            "uploads": [self.upload(seed) for seed in seeds],
+        }
+        self._count(200)
+        return web.json_response(body)
+
+    async def get_json(self, request: web.Request) -> web.StreamResponse:
+        start = time.monotonic()
+        await self._delay()
+        log = request.query.get("id", "")
+        seed = int(log[4:]) if log.startswith("mock") and log[4:].isdigit() else -1
+        if not 0 <= seed < self.config.logs:
+            self._count(404)
+            return web.json_response({"error": "Log not found"}, status=404)
+        if error := self._error():
+            return error
+
+        data = self.payload(seed)
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        response.content_length = len(data)
+        await response.prepare(request)
+        for offset in range(0, len(data), CHUNK_SIZE):
+            chunk = data[offset : offset + CHUNK_SIZE]
+            await response.write(chunk)
+            self.stats.bytes_sent += len(chunk)
+            if self.config.bandwidth:
+                await asyncio.sleep(len(chunk) / self.config.bandwidth)
+        await response.write_eof()
+        self._count(200)
+        self.stats.latencies.append(time.monotonic() - start)
+        return response
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats.summary())
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.stats = MockStats()
+        return web.json_response({})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/getUploads", self.get_uploads)
+        app.router.add_get("/getJson", self.get_json)
+        # not part of dps.report
+        app.router.add_get("/stats", self.get_stats)
+        app.router.add_post("/stats/reset", self.reset_stats)
+        return app
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = MockConfig()
+    parser.add_argument("--logs", type=int, default=defaults.logs)
+    parser.add_argument("--per-page", type=int, default=defaults.per_page)
+    parser.add_argument(
+        "--players",
+        type=int,
+        default=defaults.players,
+        help="Players per log, which decides the payload size.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=defaults.latency,
+        help="Seconds until the first byte of a response.",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=defaults.jitter,
+        help="Random share of the latency that is added or removed.",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=defaults.bandwidth,
+        help="Bytes per second of each log download, unlimited by default.",
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=defaults.rate_limit_rate,
+        help="Share of requests that are answered with 429.",
+    )
+    parser.add_argument(
+        "--server-error-rate",
+        type=float,
+        default=defaults.server_error_rate,
+        help="Share of requests that are answered with 503.",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_arguments(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        args.logs,
+        args.per_page,
+        args.players,
+        args.latency,
+        args.jitter,
+        args.bandwidth,
+        args.rate_limit_rate,
+        args.server_error_rate,
+        args.seed,
+    )
+
+
+def serve(config: MockConfig, port: int = PORT):
+    web.run_app(MockServer(config).app(), port=port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve synthetic logs like the dps.report API."
+    )
+    parser.add_argument("--port", type=int, default=PORT)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    serve(config_from_arguments(args), args.port)
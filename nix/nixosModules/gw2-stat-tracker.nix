@@ -35,6 +35,71 @@ in
           type = lib.types.str;
         };
       };
+      metricsPort = lib.mkOption {
+        default = 0;
+        example = 9464;
+        description = ''
+          Serve the timings and cache counters of the app in the Prometheus text format
+          on http://<metricsAddress>:<port>/metrics. Disabled if 0.
+        '';
+        type = lib.types.port;
+      };
+      metricsAddress = lib.mkOption {
+        default = "127.0.0.1";
+        example = "0.0.0.0";
+        description = ''
+          Address that the metrics are served on (see metricsPort).
+          Only reachable from this host by default, the metrics are not meant to be public.
+        '';
+        type = lib.types.str;
+      };
+      environmentFile = lib.mkOption {
+        default = null;
+        example = "/run/secrets/gw2-stat-tracker.env";
+        description = ''
+          Environment file with secrets like DPS_REPORT_TOKENS, see systemd.exec(5).
+          It is loaded by both the app and the ingest service, so keep it out of the nix store.
+        '';
+        type = lib.types.nullOr lib.types.path;
+      };
+      ingest = {
+        enable = lib.mkEnableOption ''
+          Fetch and process the logs of all DPS_REPORT_TOKENS with a separate service on a schedule.
+          The app then only reads those tokens from the shared log store.
+          The service uses the same environment and environmentFile as the gw2-stat-tracker service.
+        '';
+        onCalendar = lib.mkOption {
+          default = "*:0/5";
+          example = "hourly";
+          description = "When to run the ingestion, see systemd.time(7).";
+          type = lib.types.str;
+        };
+        backfill = lib.mkEnableOption ''
+          Also fetch all older uploads of the tokens, not only the newest pages.
+          The backfill is throttled and continues where it stopped on the next run.
+        '';
+        backfillPages = lib.mkOption {
+          default = 10;
+          example = 0;
+          description = ''
+            Pages of older uploads that are backfilled per token and run,
+            so that new logs are not delayed until the whole history is fetched.
+            0 backfills everything in one run.
+          '';
+          type = lib.types.ints.unsigned;
+        };
+        metricsFile = lib.mkOption {
+          default = null;
+          example = "/var/lib/prometheus-node-exporter-text-files/gw2-stat-tracker-ingest.prom";
+          description = ''
+            Write the timings (list fetch, download, parse, transform, store, ...) and counters
+            of every ingest run to this file in the Prometheus text format.
+            The ingest service does not run long enough to be scraped like the app (see metricsPort),
+            so export the file with the textfile collector of the node exporter instead.
+          '';
+          type = lib.types.nullOr lib.types.str;
+        };
+      };
     };
   };
 
@@ -48,7 +113,33 @@ in
         Unit = "gw2-stat-tracker-restart";
       };
     };
+    systemd.timers."gw2-stat-tracker-ingest" = lib.mkIf config.gw2-stat-tracker.ingest.enable {
+      wantedBy = [ "timers.target" ];
+      timerConfig = {
+        OnCalendar = config.gw2-stat-tracker.ingest.onCalendar;
+        Persistent = "true";
+        Unit = "gw2-stat-tracker-ingest.service";
+      };
+    };
     systemd.services = {
+      "gw2-stat-tracker-ingest" = lib.mkIf config.gw2-stat-tracker.ingest.enable {
+        description = "Service for fetching and processing the logs of the gw2 streamlit app";
+        script = ''
+          cd ${WorkingDirectory}
+          ${pkgs.nix}/bin/nix run "github:punsii/gw2_stats_tracker/master#ingest" -- ${lib.optionalString config.gw2-stat-tracker.ingest.backfill "--backfill --backfill-pages ${toString config.gw2-stat-tracker.ingest.backfillPages}"} ${lib.optionalString (config.gw2-stat-tracker.ingest.metricsFile != null) "--metrics-file ${config.gw2-stat-tracker.ingest.metricsFile}"}
+        '';
+        # The metrics port is taken by the app, see ingest.metricsFile instead
+        environment = config.systemd.services."gw2-stat-tracker".environment // {
+          GW2_METRICS_PORT = "0";
+        };
+        requires = [ "network-online.target" ];
+        after = [ "network-online.target" ];
+        serviceConfig = {
+          Type = "oneshot";
+          # The tokens usually come from here, so share it with the app (see environmentFile)
+          EnvironmentFile = config.systemd.services."gw2-stat-tracker".serviceConfig.EnvironmentFile or [ ];
+        };
+      };
       "gw2-stat-tracker-restart" = {
         description = "Service for restarting the gw2 streamlit app";
         script = ''
@@ -66,10 +157,19 @@ in
           cd ${WorkingDirectory}
           ${pkgs.nix}/bin/nix run "github:punsii/gw2_stats_tracker/master"
         '';
+        environment = {
+          # Processed logs are kept here, so they survive the nightly restart.
+          GW2_LOG_STORE_DIR = "${WorkingDirectory}/log_store";
+          GW2_EXTERNAL_INGESTION = if config.gw2-stat-tracker.ingest.enable then "1" else "0";
+          GW2_METRICS_PORT = toString config.gw2-stat-tracker.metricsPort;
+          GW2_METRICS_ADDRESS = config.gw2-stat-tracker.metricsAddress;
+        };
         wantedBy = [ "multi-user.target" ];
         requires = [ "network-online.target" ];
         after = [ "network-online.target" ];
-        # serviceConfig = { };
+        serviceConfig = {
+          EnvironmentFile = lib.mkIf (config.gw2-stat-tracker.environmentFile != null) config.gw2-stat-tracker.environmentFile;
+        };
       };
     };
 
@@ -1,9 +1,13 @@
-from typing import List
-
+import ijson
+import numpy as np
 import pandas as pd
 
 from color_lib import spec_color_map
 
+# Version of the output of `transform_log`. Bump it whenever that output changes,
+# stored logs of older versions are then rebuilt from the raw log archive.
+TRANSFORM_VERSION = 1
+
 
 class FightInvalidException(Exception):
     pass
@@ -84,6 +88,16 @@ _BOON_SELECTORS = ["generation", "generation", "uptime"]
 BOON_KEYS = sorted(
     [id + postfix for postfix in BOON_CATEGORIES_OUT for id in BOON_IDS.values()]
 ) + ["Bufffood (uptime%)"]
+# Position of each boon in the arrays of `_boon_array`
+_BOON_INDEX = {boon_id: i for i, boon_id in enumerate(BOON_IDS)}
+_BOON_COLUMNS = [
+    name + postfix for postfix in BOON_CATEGORIES_OUT for name in BOON_IDS.values()
+]
+
+# Strings that repeat on every row, stored as categoricals by `compact_frame`
+_CATEGORICAL_KEYS = ["id", "account", "name", "profession", "profession+name"]
+# Floats are stored as float32 if no value changes by more than this
+_FLOAT32_RTOL = 1e-6
 
 AURA_IDS = {
     # 10332: "ChaosAura",
@@ -222,47 +236,73 @@ RENAMED_KEYS = {
 }
 
 
-def explode_apply(df: pd.DataFrame, column: str):
-    new_columns = df.explode(column)[column].apply(pd.Series)
-    if df.shape[0] != new_columns.shape[0]:
-        raise FightInvalidException("Multiple fights in one log detected!")
-    return pd.concat([df.drop(columns=[column]), new_columns], axis=1)
+_STAT_COLUMNS = ["dpsAll", "support", "statsAll"]
+# Player keys that are flattened into separate columns by `_player_record`
+_NESTED_KEYS = (
+    _STAT_COLUMNS
+    + _BOON_CATEGORIES_IN
+    + [
+        "consumables",
+        "extHealingStats",
+        "extBarrierStats",
+    ]
+)
+# Keys that would be dropped from the result anyway, so they are never copied
+_SKIPPED_KEYS = set(_DROP_KEYS + _INTERMEDIATE_KEYS) - {"activeTimes"}
+
+_FILTERED_BUFFS = [
+    9283,  # Reinforced armor
+    46587,  # Malnourished
+    46668,  # Diminished
+]
 
 
-def transform_log(log: dict, log_id: str) -> pd.DataFrame:
-    df = pd.DataFrame({k: [v] for k, v in ({"id": log_id} | log).items()})
+def _player_record(
+    player: dict, log_columns: dict, float_keys: set
+) -> tuple[dict, list]:
+    record = dict(log_columns)
+    for key, value in player.items():
+        if key in _NESTED_KEYS or key in _SKIPPED_KEYS:
+            continue
+        record[key] = value[0] / 1000 if key == "activeTimes" else value
 
-    # create a separate row for each player of a fight
-    players = df.explode("players")["players"].apply(pd.Series)
-    # and join to original dataFrame
-    df = df.drop(columns=["players"])
-    df = df.join(players)
+    # create a separate column for each stat
+    for column in _STAT_COLUMNS:
+        stats = player.get(column) or []
+        if len(stats) > 1:
+            raise FightInvalidException("Multiple fights in one log detected!")
+        if not stats:
+            continue
+        stat_keys = [key for key in stats[0] if key not in _SKIPPED_KEYS]
+        for key in stat_keys:
+            record[key] = stats[0][key]
+        # A single float value turns all numbers of the same stat entry into floats
+        if any(isinstance(value, float) for value in stats[0].values()):
+            float_keys.update(stat_keys)
+
+    # calculated after all records are built
+    record["Bufffood (uptime%)"] = 0
+    consumables = player.get("consumables")
+    food_durations = (
+        [e["duration"] for e in consumables if e["id"] not in _FILTERED_BUFFS]
+        if hasattr(consumables, "__len__")
+        else []
+    )
 
-    df["activeTimes"] = df["activeTimes"].apply(lambda x: x[0] / 1000)
+    # Players without the healing addon get NaN healing and barrier,
+    # also if other players of the same log have it
+    if "extHealingStats" in player:
+        healing = player["extHealingStats"]["outgoingHealing"][0]
+        record["downedHealing"] = healing["downedHps"]
+        record["healing"] = healing["hps"] - healing["downedHps"]
+    if "extBarrierStats" in player:
+        record["barrier"] = player["extBarrierStats"]["outgoingBarrier"][0]["bps"]
 
-    # create a separate column for each stat
-    for column in ["dpsAll", "support", "statsAll"]:
-        df = explode_apply(df, column)
+    return record, (food_durations + [0, 0])[:2]
 
-    # filter out players that did not acually participate in the fight
-    df = df[
-        (df["dps"] >= 50)
-        | (df["blocked"] >= 5)
-        | (df["evaded"] >= 5)
-        | (df["boonStrips"] >= 5)
-        | (df["condiCleanse"] >= 10)
-    ]
-    # filter out unknown players (pl-*)
-    df = df[~df["account"].str.startswith("Non Squad Player")]
-    if df.size == 0:
-        # No players actually participated...
-        raise FightInvalidException(f"Log {log_id} contains no active players!")
-    for column in _BOON_CATEGORIES_IN:
-        if column not in df:
-            # too lazy to think about what to do here
-            raise FightInvalidException(f"Log {log_id} does not contain {column}!")
 
-    # Same idea for the boons, but we have a more complicated data structure to begin with:
+def _boon_array(players: list) -> np.ndarray:
+    # The boons have a more complicated data structure to begin with:
     # "groupBuffsActive": [
     #   {
     #     "id": 1187,
@@ -275,84 +315,81 @@ def transform_log(log: dict, log_id: str) -> pd.DataFrame:
     #   },
     #   {....}
     # ]
+    # so they are collected into a (players x categories x boons) array in a single pass.
+    boons = np.zeros((len(players), len(_BOON_CATEGORIES_IN), len(BOON_IDS)))
+    for i, player in enumerate(players):
+        for j, (category, selector) in enumerate(
+            zip(_BOON_CATEGORIES_IN, _BOON_SELECTORS)
+        ):
+            buffs = player.get(category)
+            if not isinstance(buffs, list):
+                continue
+            for buff in buffs:
+                k = _BOON_INDEX.get(buff["id"])
+                if k is not None:
+                    boons[i, j, k] = buff["buffData"][0][selector]
+    return boons
+
+
+def _is_active(record: dict) -> bool:
+    # filter out players that did not acually participate in the fight
+    # and unknown players (pl-*)
+    return (
+        record.get("dps", 0) >= 50
+        or record.get("blocked", 0) >= 5
+        or record.get("evaded", 0) >= 5
+        or record.get("boonStrips", 0) >= 5
+        or record.get("condiCleanse", 0) >= 10
+    ) and not str(record.get("account")).startswith("Non Squad Player")
+
+
+def _log_records(log: dict, log_id: str, float_keys: set) -> tuple[list, list, list]:
+    # Values that are the same for every player of the fight
+    log_columns = {
+        "id": log_id,
+        "timeStart": pd.to_datetime(log["timeStart"][:-4], format="%Y-%m-%d %H:%M:%S")
+        + pd.Timedelta(hours=5),
+        "duration": pd.to_timedelta(log["duration"]).total_seconds(),
+    }
 
-    EMPTY_BOON_MAP = {k: 0 for k in BOON_IDS.keys()}
-    df = pd.concat(
-        [
-            df[column_name_in]  # type: ignore
-            .map(  # type: ignore
-                lambda cell_value: (
-                    EMPTY_BOON_MAP
-                    if not isinstance(cell_value, List)
-                    else EMPTY_BOON_MAP
-                    | {
-                        e["id"]: e["buffData"][0][selector]
-                        for e in cell_value
-                        if e["id"] in BOON_IDS.keys()
-                    }
-                )
-            )
-            .apply(pd.Series)
-            .rename(columns={k: v + column_name_out for k, v in BOON_IDS.items()})
-            for column_name_in, column_name_out, selector in zip(
-                _BOON_CATEGORIES_IN,
-                BOON_CATEGORIES_OUT,
-                _BOON_SELECTORS,
-            )
-        ]
-        + [df.drop(columns=_BOON_CATEGORIES_IN)],
-        axis=1,
-    )
+    # create a separate row for each player of a fight
+    records = []
+    food_durations = []
+    players = []
+    for player in log["players"]:
+        record, food = _player_record(player, log_columns, float_keys)
+        if _is_active(record):
+            records.append(record)
+            food_durations.append(food)
+            players.append(player)
+    if not records:
+        # No players actually participated...
+        raise FightInvalidException(f"Log {log_id} contains no active players!")
+    for column in _BOON_CATEGORIES_IN:
+        if not any(column in player for player in log["players"]):
+            # too lazy to think about what to do here
+            raise FightInvalidException(f"Log {log_id} does not contain {column}!")
+    return records, food_durations, players
 
-    filtered_buffs = [
-        9283,  # Reinforced armor
-        46587,  # Malnourished
-        46668,  # Diminished
-    ]
-    df["Bufffood (uptime%)"] = 0
-    if "consumables" in df.columns:
-        df["consumables"] = df["consumables"].map(
-            lambda cell_value: (
-                [e["duration"] for e in cell_value if e["id"] not in filtered_buffs]
-                if hasattr(cell_value, "__len__")
-                else []
-            )
-        )
-        df["Bufffood (uptime%)"] = (
-            df["consumables"]
-            .map(lambda e: e[0] if len(e) > 0 else 0)
-            .div(1000)
-            .div(df["activeTimes"])
-            .clip(0, 1)
-            + df["consumables"]
-            .map(lambda e: e[1] if len(e) > 1 else 0)
-            .div(1000)
-            .div(df["activeTimes"])
-            .clip(0, 1)
-        ).div(2)
-        df = df.drop(columns=["consumables"])
-
-    if "extHealingStats" in df.columns:
-        df["downedHealing"] = df["extHealingStats"].apply(
-            lambda x: x["outgoingHealing"][0]["downedHps"]
-        )
-        df["healing"] = (
-            df["extHealingStats"].apply(lambda x: x["outgoingHealing"][0]["hps"])
-            - df["downedHealing"]
-        )
-        df = df.drop(columns="extHealingStats")
-    if "extBarrierStats" in df.columns:
-        df["barrier"] = df["extBarrierStats"].apply(
-            lambda x: x["outgoingBarrier"][0]["bps"]
-        )
-        df = df.drop(columns="extBarrierStats")
 
-    # filter useless columns
-    df = df.drop(columns=_DROP_KEYS, errors="ignore")
+def _records_to_frame(
+    records: list, food_durations: list, players: list, float_keys: set
+) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(records)
+    df = df.astype({key: "float64" for key in float_keys})
+
+    # like the other absolute values below, boons are transformed to values per second
+    boons = _boon_array(players).reshape(len(players), -1)
+    boons /= df["activeTimes"].to_numpy()[:, np.newaxis]
+    df = pd.concat([pd.DataFrame(boons, columns=_BOON_COLUMNS), df], axis=1)
+
+    food = pd.DataFrame(food_durations)
+    food = food.div(1000).div(df["activeTimes"], axis=0).clip(0, 1)
+    df["Bufffood (uptime%)"] = (food[0] + food[1]).div(2)
 
     # add some helper columns
-    df["spec_color"] = df["profession"].apply(lambda spec: spec_color_map[spec])
-    df["profession+name"] = df["profession"].apply(lambda s: s + " | ") + df["name"]
+    df["spec_color"] = df["profession"].map(spec_color_map)
+    df["profession+name"] = df["profession"] + " | " + df["name"]
 
     # cleanup data
     # skillCastUptime does not exist in older versions
@@ -367,24 +404,13 @@ def transform_log(log: dict, log_id: str) -> pd.DataFrame:
         df["skillCastUptimeNoAA"] = df["skillCastUptimeNoAA"].clip(5, 95)
 
     # absolute values are way less accurate than values per second, so transform some of them
-    for key in _DIVIDE_BY_TIME_KEYS:
-        if key not in df:
-            continue
-        df[key] = df[key] / df["activeTimes"]
-    for key in BOON_KEYS:
-        df[key] = df[key] / df["activeTimes"]
-        if "uptime" in key:
-            df[key] = df[key].clip(0, 1)
-
-    # add "percentage alive" as it is more understandable than "activeTimes" and fix the "duration" for that
-    df["duration"] = pd.to_timedelta(df["duration"]).dt.total_seconds()  # type: ignore
-    df["percentageAlive"] = df["activeTimes"] / df["duration"]
+    divide_keys = [key for key in _DIVIDE_BY_TIME_KEYS if key in df]
+    divide_keys += ["Bufffood (uptime%)"]
+    df[divide_keys] = df[divide_keys].div(df["activeTimes"], axis=0)
+    df["Bufffood (uptime%)"] = df["Bufffood (uptime%)"].clip(0, 1)
 
-    # fix datetime columns
-    for key in ["timeStart", "timeEnd"]:
-        df[key] = pd.to_datetime(
-            df[key].apply(lambda t: t[:-4]), format="%Y-%m-%d %H:%M:%S"
-        ) + pd.Timedelta(hours=5)
+    # add "percentage alive" as it is more understandable than "activeTimes"
+    df["percentageAlive"] = df["activeTimes"] / df["duration"]
 
     # remove keys that were only needed for calculations
     df = df.drop(columns=_INTERMEDIATE_KEYS, errors="ignore")
@@ -394,6 +420,32 @@ def transform_log(log: dict, log_id: str) -> pd.DataFrame:
     return df
 
 
+def transform_log(log: dict, log_id: str) -> pd.DataFrame:
+    float_keys = set()
+    return _records_to_frame(*_log_records(log, log_id, float_keys), float_keys)
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Memory friendly dtypes for the combined frame of many logs.
+    # Not applied per log, as concatenating different categoricals falls back to objects.
+    df = df.copy()
+    for column in _CATEGORICAL_KEYS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    # The colors are fixed per profession, so they are only mapped once per category
+    if "spec_color" in df:
+        df["spec_color"] = df["profession"].map(spec_color_map).astype("category")
+
+    for column in df.select_dtypes(include="integer"):
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    for column in df.select_dtypes(include="float"):
+        values = df[column].to_numpy()
+        compact = values.astype("float32")
+        if np.allclose(compact, values, rtol=_FLOAT32_RTOL, atol=0, equal_nan=True):
+            df[column] = compact
+    return df
+
+
 def strip_log_data(log):
     if "WvW" not in log["fightName"] and "World vs World" not in log["fightName"]:
         raise FightInvalidException(f"Log is not a WvW fight ({log['fightName']=})")
@@ -405,3 +457,89 @@ def strip_log_data(log):
             if key not in _RELEVANT_KEYS_DATA_PLAYERS:
                 del player[key]
     return log
+
+
+# Top level keys that come before "players" in the log.
+_HEADER_KEYS = ["fightName"] + [key for key in _RELEVANT_KEYS_DATA if key != "players"]
+
+
+class _HeaderSink:
+    def __init__(self, parser: "_HeaderParser"):
+        self.parser = parser
+
+    def send(self, event):
+        prefix, event_type, value = event
+        if prefix not in _HEADER_KEYS or event_type in ("start_map", "start_array"):
+            return
+        self.parser.header[prefix] = value
+        if (
+            prefix == "fightName"
+            and "WvW" not in value
+            and "World vs World" not in value
+        ):
+            self.parser.error = FightInvalidException(
+                f"Log is not a WvW fight (fightName={value!r})"
+            )
+            self.parser.done = True
+        if len(self.parser.header) == len(_HEADER_KEYS):
+            self.parser.header_done = True
+
+
+class _PlayerSink:
+    def __init__(self, players: list):
+        self.players = players
+
+    def send(self, player: dict):
+        self.players.append(
+            {k: v for k, v in player.items() if k in _RELEVANT_KEYS_DATA_PLAYERS}
+        )
+
+
+class _HeaderParser:
+    # `done` is set as soon as the log turns out to be invalid, `close` raises the error.
+    def __init__(self):
+        self.done = False
+        self.error: FightInvalidException | None = None
+        self.header = {}
+        self.header_done = False
+        # Handling every parser event in python is slow,
+        # so the header parser is only fed until all header keys are found.
+        self._header_parser = ijson.parse_coro(_HeaderSink(self))
+
+    def feed(self, chunk: bytes):
+        if not self.header_done:
+            self._header_parser.send(chunk)
+
+
+class LogParser(_HeaderParser):
+    # Incremental alternative to `strip_log_data(json.loads(data))`:
+    # Feed the log in chunks while it is being downloaded, only the keys in
+    # _RELEVANT_KEYS_DATA and _RELEVANT_KEYS_DATA_PLAYERS are kept
+    # and only one player at a time is fully built.
+    def __init__(self):
+        super().__init__()
+        self.players = []
+        self._players_parser = ijson.items_coro(
+            _PlayerSink(self.players), "players.item", use_float=True
+        )
+
+    def feed(self, chunk: bytes):
+        super().feed(chunk)
+        if not self.done:
+            self._players_parser.send(chunk)
+
+    def close(self) -> dict:
+        if self.error:
+            raise self.error
+        self._players_parser.close()
+        if "fightName" not in self.header:
+            raise FightInvalidException("Log does not contain a fightName")
+        log = {k: v for k, v in self.header.items() if k in _RELEVANT_KEYS_DATA}
+        log["players"] = self.players
+        return log
+
+
+def parse_log(data: bytes) -> dict:
+    parser = LogParser()
+    parser.feed(data)
+    return parser.close()
@@ -0,0 +1,278 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from color_lib import spec_color_map
+from process_logs import BOON_IDS
+
+# Deterministic Elite Insights JSON of WvW fights for benchmarks and the mock dps.report server.
+# The same seed always gives the same log.
+
+# Boons that are not tracked by process_logs, e.g. Alacrity, still show up in real logs
+UNTRACKED_BOON_IDS = [30328, 10269, 13017]
+# Player sections that older EI versions or players without the healing addon do not have
+OPTIONAL_SECTIONS = ["consumables", "extHealingStats", "extBarrierStats"]
+# Bufffood, utility and the consumables that are filtered by process_logs
+_CONSUMABLE_IDS = [57100, 57276, 9283, 46587, 46668]
+# Log n starts 7 minutes after log n - 1
+_START = datetime(2024, 1, 1, 20, tzinfo=timezone(timedelta(hours=1)))
+
+_DPS_KEYS = [
+    "dps",
+    "damage",
+    "condiDps",
+    "condiDamage",
+    "powerDps",
+    "powerDamage",
+    "breakbarDamage",
+    "actorDps",
+    "actorDamage",
+    "actorCondiDps",
+    "actorCondiDamage",
+    "actorPowerDps",
+    "actorPowerDamage",
+    "actorBreakbarDamage",
+]
+_SUPPORT_KEYS = [
+    "resurrects",
+    "resurrectTime",
+    "condiCleanse",
+    "condiCleanseTime",
+    "condiCleanseSelf",
+    "condiCleanseTimeSelf",
+    "boonStrips",
+    "boonStripsTime",
+    "boonStripDownContribution",
+    "boonStripDownContributionTime",
+    "stunBreak",
+    "removedStunDuration",
+]
+_STATS_KEYS = [
+    "wasted",
+    "timeWasted",
+    "saved",
+    "timeSaved",
+    "stackDist",
+    "distToCom",
+    "avgBoons",
+    "avgActiveBoons",
+    "avgConditions",
+    "avgActiveConditions",
+    "swapCount",
+    "skillCastUptime",
+    "skillCastUptimeNoAA",
+    "totalDamageCount",
+    "totalDmg",
+    "directDamageCount",
+    "directDmg",
+    "connectedDamageCount",
+    "connectedDmg",
+    "criticalRate",
+    "criticalDmg",
+    "flankingRate",
+    "againstMovingRate",
+    "glanceRate",
+    "missed",
+    "evaded",
+    "blocked",
+    "interrupts",
+    "invulned",
+    "killed",
+    "downed",
+    "downContribution",
+    "appliedCrowdControl",
+    "appliedCrowdControlDownContribution",
+    "appliedCrowdControlDuration",
+    "appliedCrowdControlDurationDownContribution",
+]
+# EI writes these as floats, all others as integers
+_FLOAT_KEYS = {
+    "resurrectTime",
+    "condiCleanseTime",
+    "condiCleanseTimeSelf",
+    "boonStripsTime",
+    "boonStripDownContributionTime",
+    "removedStunDuration",
+    "timeWasted",
+    "timeSaved",
+    "stackDist",
+    "distToCom",
+    "avgBoons",
+    "avgActiveBoons",
+    "avgConditions",
+    "avgActiveConditions",
+    "skillCastUptime",
+    "skillCastUptimeNoAA",
+}
+
+
+def _stats(r: random.Random, keys: list, scale: float) -> dict:
+    return {
+        key: (
+            round(r.uniform(0, 100), 3)
+            if key in _FLOAT_KEYS
+            else int(r.expovariate(1 / scale))
+        )
+        for key in keys
+    }
+
+
+def _buffs(r: random.Random, boons: list, selector: str) -> list:
+    return [
+        {
+            "id": boon_id,
+            "buffData": [
+                {
+                    selector: round(r.uniform(0, 100), 3),
+                    "overstack": round(r.uniform(0, 100), 3),
+                    "wasted": 0.0,
+                }
+            ],
+        }
+        for boon_id in boons
+        if r.random() < 0.85
+    ]
+
+
+def _player(
+    r: random.Random,
+    i: int,
+    duration_ms: int,
+    specs: list,
+    boons: list,
+    rotation: list,
+) -> dict:
+    active_time = r.randint(duration_ms // 3, duration_ms)
+    return {
+        "name": f"Character {r.randint(0, 199)}",
+        "totalHealth": r.choice([11645, 15082, 19212]),
+        "condition": r.randint(0, 10),
+        "concentration": r.randint(0, 10),
+        "healing": r.randint(0, 10),
+        "toughness": r.randint(0, 10),
+        "hitboxHeight": 300,
+        "hitboxWidth": 96,
+        "instanceID": 1000 + i,
+        "isFake": False,
+        "dpsAll": [_stats(r, _DPS_KEYS, 1500)],
+        "statsAll": [_stats(r, _STATS_KEYS, 20)],
+        "defenses": [{"damageTaken": r.randint(0, 10**6), "blockedCount": 0}],
+        "support": [_stats(r, _SUPPORT_KEYS, 10)],
+        # Large sections that are dropped by strip_log_data
+        "damage1S": [list(range(0, duration_ms, 1000))],
+        "rotation": rotation,
+        # The first player is not part of the squad and filtered by process_logs
+        "account": f"Account.{r.randint(1000, 1299)}" if i else "Non Squad Player 1",
+        "group": r.randint(1, 10),
+        "hasCommanderTag": i == 1,
+        "profession": r.choice(specs),
+        "weapons": ["Sword", "Shield", "Staff", "Unknown"],
+        "groupBuffsActive": _buffs(r, boons, "generation"),
+        "squadBuffsActive": _buffs(r, boons, "generation"),
+        "buffUptimesActive": _buffs(r, boons, "uptime"),
+        "consumables": [
+            {
+                "id": r.choice(_CONSUMABLE_IDS),
+                "duration": r.randint(0, 2 * duration_ms),
+                "stack": 1,
+                "time": 0,
+            }
+            for _ in range(r.randint(0, 3))
+        ],
+        "activeTimes": [active_time],
+        "extHealingStats": {
+            "outgoingHealing": [
+                {"hps": r.randint(0, 1500), "downedHps": r.randint(0, 200)}
+            ]
+        },
+        "extBarrierStats": {"outgoingBarrier": [{"bps": r.randint(0, 800)}]},
+    }
+
+
+def log_start(seed: int) -> datetime:
+    return _START + timedelta(minutes=seed * 7)
+
+
+def format_time(t: datetime) -> str:
+    # Like timeStart and timeEnd of EI
+    return t.strftime("%Y-%m-%d %H:%M:%S %z")[:-2]
+
+
+def synthetic_log(
+    seed: int,
+    players: int = 50,
+    specs: list[str] | None = None,
+    boons: list[int] | None = None,
+    missing_sections: Iterable[str] = (),
+    missing_rate: float = 0.2,
+) -> dict:
+    # `specs` and `boons` default to all known specs and the tracked plus some untracked boons.
+    # `missing_sections` are removed from every player,
+    # the OPTIONAL_SECTIONS from a share of `missing_rate` of the players.
+    r = random.Random(seed)
+    specs = specs or list(spec_color_map)
+    boons = list(BOON_IDS) + UNTRACKED_BOON_IDS if boons is None else boons
+    missing_sections = set(missing_sections)
+
+    start = log_start(seed)
+    duration_ms = r.randint(30_000, 900_000)
+    end = start + timedelta(milliseconds=duration_ms)
+    # The same for every player, only its size matters
+    rotation = [
+        {
+            "id": 10000 + skill,
+            "skills": [
+                {"castTime": cast, "duration": 500}
+                for cast in range(0, duration_ms, 10000)
+            ],
+        }
+        for skill in range(8)
+    ]
+    log_players = []
+    for i in range(players):
+        player = _player(r, i, duration_ms, specs, boons, rotation)
+        for section in OPTIONAL_SECTIONS:
+            if r.random() < missing_rate:
+                del player[section]
+        for section in missing_sections & player.keys():
+            del player[section]
+        log_players.append(player)
+
+    return {
+        "eliteInsightsVersion": "3.4.0.0",
+        "triggerID": 1,
+        "fightName": "Detailed WvW - Eternal Battlegrounds",
+        "fightIcon": "https://wiki.guildwars2.com/images/3/38/Eternal_Battlegrounds_%28map_icon%29.png",
+        "arcVersion": "EVTC20240101",
+        "gW2Build": 160000,
+        "language": "English",
+        "recordedBy": log_players[1]["name"] if players > 1 else "",
+        "timeStart": format_time(start),
+        "timeEnd": format_time(end),
+        "duration": f"{duration_ms // 60000:02d}m {duration_ms // 1000 % 60:02d}s {duration_ms % 1000:03d}ms",
+        "durationMS": duration_ms,
+        "success": True,
+        "isCM": False,
+        "targets": [
+            {
+                "name": "Enemy Players",
+                "totalHealth": 10**7,
+                "damage1S": [list(range(duration_ms // 1000))],
+            }
+        ],
+        "players": log_players,
+        "phases": [{"start": 0, "end": duration_ms, "name": "Full Fight"}],
+        "skillMap": {
+            f"s{i}": {"name": f"Skill {i}", "autoAttack": False} for i in range(300)
+        },
+        "buffMap": {
+            f"b{boon_id}": {"name": str(boon_id), "stacking": False}
+            for boon_id in boons
+        },
+    }
+
+
+def synthetic_log_json(seed: int, **kwargs) -> bytes:
+    # Encoded like dps.report serves it, see `synthetic_log` for the arguments
+    return json.dumps(synthetic_log(seed, **kwargs)).encode()
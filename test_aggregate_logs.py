@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregate_logs import (
+    MAX_ROLLING_WINDOW,
+    _uses_key_filters_only,
+    group_statistics,
+    rolling_averages,
+)
+from filter_logs import filter_data, filter_index
+from process_logs import RENAMED_KEYS
+
+# Parity of the precomputed aggregations with plain pandas, see conftest.py for the data
+
+GROUP_BY = ["profession", "name", "account", "profession+name"]
+
+FILTER_ATTRIBUTES = {
+    "account": "account_name_filter",
+    "name": "character_name_filter",
+    "profession": "profession_filter",
+}
+
+
+def _reference_rolling(
+    df: pd.DataFrame, group_by: str, stat: str, window: int
+) -> pd.Series:
+    # pandas' grouped weighted rolling does not match the per group one,
+    # rolling_averages follows the latter
+    groups = df.groupby(group_by, observed=True, sort=False)[stat]
+    rolled = [values.rolling(window, win_type="triang").mean() for _, values in groups]
+    return pd.concat(rolled).reindex(df.index)
+
+
+@pytest.mark.parametrize("group_by", GROUP_BY)
+@pytest.mark.parametrize("stat", [RENAMED_KEYS["dps"], RENAMED_KEYS["healing"]])
+def test_rolling_averages(df, make_filters, group_by, stat):
+    index = filter_index("rolling", df)
+    averages = rolling_averages(
+        index, make_filters(index, group_by), group_by, stat, df
+    )
+    assert list(averages.columns) == list(range(1, MAX_ROLLING_WINDOW + 1))
+    for window in averages.columns:
+        pd.testing.assert_series_equal(
+            averages[window],
+            _reference_rolling(df, group_by, stat, window),
+            check_names=False,
+        )
+
+
+def test_rolling_averages_without_group(df, make_filters):
+    # Rows with a missing group key get no average
+    df = df.copy()
+    df["name"] = df["name"].astype(object)
+    df.loc[::7, "name"] = None
+    index = filter_index("rolling without group", df)
+    stat = RENAMED_KEYS["dps"]
+    averages = rolling_averages(index, make_filters(index, "name"), "name", stat, df)
+    assert averages[df["name"].isna()].isna().all().all()
+    for window in [1, 2, 5, MAX_ROLLING_WINDOW]:
+        pd.testing.assert_series_equal(
+            averages[window],
+            _reference_rolling(df, "name", stat, window),
+            check_names=False,
+        )
+    assert np.isfinite(averages[1][df["name"].notna()]).all()
+
+
+def _group_filters(index, group_by: str, key_only: bool) -> dict:
+    # Every third value of the filtered columns, either only of the columns that
+    # are decided by the group key or of another column
+    columns = {
+        "profession": ("profession", "account"),
+        "name": ("name", "profession"),
+        "account": ("account", "name"),
+        "profession+name": ("profession", "account"),
+    }
+    key_column, other_column = columns[group_by]
+    column = key_column if key_only else other_column
+    filters = {FILTER_ATTRIBUTES[column]: list(index.categories[column][::3])}
+    if group_by == "profession+name" and key_only:
+        filters[FILTER_ATTRIBUTES["name"]] = list(index.categories["name"][::2])
+    return filters
+
+
+@pytest.mark.parametrize("group_by", GROUP_BY)
+@pytest.mark.parametrize(
+    "key_only", [True, False], ids=["key filters", "other filters"]
+)
+@pytest.mark.parametrize("dates", ["all", "range", "single"])
+def test_group_statistics(df, make_filters, group_by, key_only, dates):
+    index = filter_index("group statistics", df)
+    times = {
+        "all": (index.dates.min(), index.dates.max()),
+        "range": (index.dates[10], index.dates[-10]),
+        "single": (index.dates[20], index.dates[20]),
+    }[dates]
+    filters = make_filters(
+        index,
+        group_by,
+        start_time_min=times[0],
+        start_time_max=times[1],
+        **_group_filters(index, group_by, key_only),
+    )
+    assert _uses_key_filters_only(filters) == key_only
+    filtered = filter_data(index, filters)
+    assert not filtered.empty
+
+    means, variances = group_statistics(index, filters, filtered)
+
+    columns = [
+        c for c in filtered.select_dtypes(include="number").columns if c != group_by
+    ]
+    # Compacted columns are float32, the running totals are float64,
+    # other filters aggregate the float32 columns like pandas
+    numeric = filtered[columns]
+    if key_only:
+        numeric = numeric.astype("float64")
+    groups = numeric.groupby(filtered[group_by], observed=True)
+    for result, expected in [(means, groups.mean()), (variances, groups.var())]:
+        pd.testing.assert_frame_equal(
+            result, expected, check_index_type=False, rtol=1e-6, atol=1e-6
+        )
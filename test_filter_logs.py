@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+from filter_logs import _HIDDEN_KEYS, _KEY_CATEGORIES, filter_data, filter_index
+from process_logs import BOON_KEYS
+
+# Parity of `filter_data` with the implementation it replaced, which is frozen below.
+# See conftest.py for the data.
+
+STAT_CATEGORIES = [
+    "Default",
+    "Offense",
+    "Defense",
+    "Boons",
+    "Miscellaneous",
+    "Unlabeled",
+]
+
+
+def _reference_filter_data(df: pd.DataFrame, filters) -> pd.DataFrame:
+    df = df[df["timeStart"].between(filters.start_time_min, filters.start_time_max)]
+    if filters.character_name_filter:
+        df = df[df["name"].isin(filters.character_name_filter)]
+    if filters.account_name_filter:
+        df = df[df["account"].isin(filters.account_name_filter)]
+    if filters.profession_filter:
+        df = df[df["profession"].isin(filters.profession_filter)]
+
+    unlabeled_keys = [
+        key
+        for key in list(df)
+        if key not in _HIDDEN_KEYS
+        and key not in _KEY_CATEGORIES["Default"]
+        and key not in _KEY_CATEGORIES["Offense"]
+        and key not in _KEY_CATEGORIES["Defense"]
+        and key not in BOON_KEYS
+        and key not in _KEY_CATEGORIES["Miscellaneous"]
+    ]
+
+    result_keys = _HIDDEN_KEYS.copy()
+    match filters.stat_category:
+        case "Default":
+            result_keys += _KEY_CATEGORIES["Default"]
+        case "Offense":
+            result_keys += _KEY_CATEGORIES["Offense"]
+        case "Defense":
+            result_keys += _KEY_CATEGORIES["Defense"]
+        case "Boons":
+            result_keys += BOON_KEYS
+        case "Miscellaneous":
+            result_keys += _KEY_CATEGORIES["Miscellaneous"]
+        case "Unlabeled":
+            result_keys += unlabeled_keys
+
+    return df[result_keys]
+
+
+def _filter_values(index) -> dict:
+    return {
+        "no filters": {},
+        "names": {"character_name_filter": list(index.categories["name"][::3])},
+        "accounts": {"account_name_filter": list(index.categories["account"][::4])},
+        "professions": {"profession_filter": list(index.categories["profession"][:5])},
+        "all filters": {
+            "character_name_filter": list(index.categories["name"][::2]),
+            "account_name_filter": list(index.categories["account"][::2]),
+            "profession_filter": list(index.categories["profession"][::2]),
+        },
+        "unknown values": {
+            "character_name_filter": ["Nobody"],
+            "profession_filter": [index.categories["profession"][0], "Nothing"],
+        },
+    }
+
+
+@pytest.mark.parametrize("stat_category", STAT_CATEGORIES)
+@pytest.mark.parametrize(
+    "filter_name",
+    ["no filters", "names", "accounts", "professions", "all filters", "unknown values"],
+)
+@pytest.mark.parametrize("dates", ["all", "range", "single"])
+def test_filter_data(df, make_filters, stat_category, filter_name, dates):
+    index = filter_index("filter data", df)
+    times = {
+        "all": (index.dates.min(), index.dates.max()),
+        "range": (index.dates[10], index.dates[-10]),
+        "single": (index.dates[20], index.dates[20]),
+    }[dates]
+    filters = make_filters(
+        index,
+        stat_category=stat_category,
+        start_time_min=times[0],
+        start_time_max=times[1],
+        **_filter_values(index)[filter_name],
+    )
+    pd.testing.assert_frame_equal(
+        filter_data(index, filters), _reference_filter_data(df, filters)
+    )
+
+
+def test_filter_data_of_unsorted_logs(df, make_filters):
+    # The index sorts the rows by timeStart, the reference keeps their order
+    shuffled = df.sample(frac=1, random_state=0)
+    index = filter_index("filter unsorted data", shuffled)
+    filters = make_filters(
+        index,
+        start_time_min=index.dates[5],
+        start_time_max=index.dates[-5],
+        profession_filter=list(index.categories["profession"][::2]),
+    )
+    expected = _reference_filter_data(shuffled, filters).sort_values(
+        "timeStart", kind="stable"
+    )
+    pd.testing.assert_frame_equal(
+        filter_data(index, filters).reset_index(drop=True),
+        expected.reset_index(drop=True),
+    )
@@ -0,0 +1,256 @@
+import copy
+from typing import List
+
+import pandas as pd
+import pytest
+
+from color_lib import spec_color_map
+from process_logs import (
+    _BOON_CATEGORIES_IN,
+    _BOON_SELECTORS,
+    _DIVIDE_BY_TIME_KEYS,
+    _DROP_KEYS,
+    _INTERMEDIATE_KEYS,
+    BOON_CATEGORIES_OUT,
+    BOON_IDS,
+    BOON_KEYS,
+    RENAMED_KEYS,
+    FightInvalidException,
+    strip_log_data,
+    transform_log,
+)
+from synthetic_logs import synthetic_log
+
+# Parity of `transform_log` with the implementation it replaced,
+# which is frozen below (only the row index is reset, see `_reference`).
+
+
+def _explode_apply(df: pd.DataFrame, column: str):
+    new_columns = df.explode(column)[column].apply(pd.Series)
+    if df.shape[0] != new_columns.shape[0]:
+        raise FightInvalidException("Multiple fights in one log detected!")
+    return pd.concat([df.drop(columns=[column]), new_columns], axis=1)
+
+
+def _reference_transform_log(log: dict, log_id: str) -> pd.DataFrame:
+    df = pd.DataFrame({k: [v] for k, v in ({"id": log_id} | log).items()})
+
+    # create a separate row for each player of a fight
+    players = df.explode("players")["players"].apply(pd.Series)
+    # and join to original dataFrame
+    df = df.drop(columns=["players"])
+    df = df.join(players)
+
+    df["activeTimes"] = df["activeTimes"].apply(lambda x: x[0] / 1000)
+
+    # create a separate column for each stat
+    for column in ["dpsAll", "support", "statsAll"]:
+        df = _explode_apply(df, column)
+
+    # filter out players that did not acually participate in the fight
+    df = df[
+        (df["dps"] >= 50)
+        | (df["blocked"] >= 5)
+        | (df["evaded"] >= 5)
+        | (df["boonStrips"] >= 5)
+        | (df["condiCleanse"] >= 10)
+    ]
+    # filter out unknown players (pl-*)
+    df = df[~df["account"].str.startswith("Non Squad Player")]
+    if df.size == 0:
+        # No players actually participated...
+        raise FightInvalidException(f"Log {log_id} contains no active players!")
+    for column in _BOON_CATEGORIES_IN:
+        if column not in df:
+            # too lazy to think about what to do here
+            raise FightInvalidException(f"Log {log_id} does not contain {column}!")
+
+    EMPTY_BOON_MAP = {k: 0 for k in BOON_IDS.keys()}
+    df = pd.concat(
+        [
+            df[column_name_in]  # type: ignore
+            .map(  # type: ignore
+                lambda cell_value: (
+                    EMPTY_BOON_MAP
+                    if not isinstance(cell_value, List)
+                    else EMPTY_BOON_MAP
+                    | {
+                        e["id"]: e["buffData"][0][selector]
+                        for e in cell_value
+                        if e["id"] in BOON_IDS.keys()
+                    }
+                )
+            )
+            .apply(pd.Series)
+            .rename(columns={k: v + column_name_out for k, v in BOON_IDS.items()})
+            for column_name_in, column_name_out, selector in zip(
+                _BOON_CATEGORIES_IN,
+                BOON_CATEGORIES_OUT,
+                _BOON_SELECTORS,
+            )
+        ]
+        + [df.drop(columns=_BOON_CATEGORIES_IN)],
+        axis=1,
+    )
+
+    filtered_buffs = [
+        9283,  # Reinforced armor
+        46587,  # Malnourished
+        46668,  # Diminished
+    ]
+    df["Bufffood (uptime%)"] = 0
+    if "consumables" in df.columns:
+        df["consumables"] = df["consumables"].map(
+            lambda cell_value: (
+                [e["duration"] for e in cell_value if e["id"] not in filtered_buffs]
+                if hasattr(cell_value, "__len__")
+                else []
+            )
+        )
+        df["Bufffood (uptime%)"] = (
+            df["consumables"]
+            .map(lambda e: e[0] if len(e) > 0 else 0)
+            .div(1000)
+            .div(df["activeTimes"])
+            .clip(0, 1)
+            + df["consumables"]
+            .map(lambda e: e[1] if len(e) > 1 else 0)
+            .div(1000)
+            .div(df["activeTimes"])
+            .clip(0, 1)
+        ).div(2)
+        df = df.drop(columns=["consumables"])
+
+    if "extHealingStats" in df.columns:
+        df["downedHealing"] = df["extHealingStats"].apply(
+            lambda x: x["outgoingHealing"][0]["downedHps"]
+        )
+        df["healing"] = (
+            df["extHealingStats"].apply(lambda x: x["outgoingHealing"][0]["hps"])
+            - df["downedHealing"]
+        )
+        df = df.drop(columns="extHealingStats")
+    if "extBarrierStats" in df.columns:
+        df["barrier"] = df["extBarrierStats"].apply(
+            lambda x: x["outgoingBarrier"][0]["bps"]
+        )
+        df = df.drop(columns="extBarrierStats")
+
+    # filter useless columns
+    df = df.drop(columns=_DROP_KEYS, errors="ignore")
+
+    # add some helper columns
+    df["spec_color"] = df["profession"].apply(lambda spec: spec_color_map[spec])
+    df["profession+name"] = df["profession"].apply(lambda s: s + " | ") + df["name"]
+
+    # cleanup data
+    df["distToCom"] = df["distToCom"].clip(0, 1500)
+    if "skillCastUptime" in df:
+        df["skillCastUptime"] = df["skillCastUptime"].clip(5, 95)
+    if "skillCastUptimeNoAA" in df:
+        df["skillCastUptimeNoAA"] = df["skillCastUptimeNoAA"].clip(5, 95)
+
+    # absolute values are way less accurate than values per second, so transform some of them
+    for key in _DIVIDE_BY_TIME_KEYS:
+        if key not in df:
+            continue
+        df[key] = df[key] / df["activeTimes"]
+    for key in BOON_KEYS:
+        df[key] = df[key] / df["activeTimes"]
+        if "uptime" in key:
+            df[key] = df[key].clip(0, 1)
+
+    # add "percentage alive" as it is more understandable than "activeTimes" and fix the "duration" for that
+    df["duration"] = pd.to_timedelta(df["duration"]).dt.total_seconds()  # type: ignore
+    df["percentageAlive"] = df["activeTimes"] / df["duration"]
+
+    # fix datetime columns
+    for key in ["timeStart", "timeEnd"]:
+        df[key] = pd.to_datetime(
+            df[key].apply(lambda t: t[:-4]), format="%Y-%m-%d %H:%M:%S"
+        ) + pd.Timedelta(hours=5)
+
+    # remove keys that were only needed for calculations
+    df = df.drop(columns=_INTERMEDIATE_KEYS, errors="ignore")
+
+    # rename for better UX
+    df.rename(columns=RENAMED_KEYS, inplace=True)
+    return df
+
+
+def _reference(log: dict, log_id: str) -> pd.DataFrame:
+    # The old rows kept the index of the single log row (all 0)
+    return _reference_transform_log(copy.deepcopy(log), log_id).reset_index(drop=True)
+
+
+def _log(seed: int, **kwargs) -> dict:
+    return strip_log_data(synthetic_log(seed, **kwargs))
+
+
+def _without(log: dict, section: str, every: int = 1) -> dict:
+    # Removes `section` from every `every`th player
+    for player in log["players"][::every]:
+        player.pop(section, None)
+    return log
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_complete_logs(seed):
+    log = _log(seed, missing_rate=0)
+    pd.testing.assert_frame_equal(transform_log(log, "log"), _reference(log, "log"))
+
+
+@pytest.mark.parametrize(
+    "log",
+    [
+        _without(_log(10, missing_rate=0), "consumables"),
+        _without(_log(11, missing_rate=0), "consumables", every=2),
+        _without(
+            _without(_log(12, missing_rate=0), "extHealingStats"), "extBarrierStats"
+        ),
+        _without(_log(13, missing_rate=0), "groupBuffsActive", every=3),
+        _log(14, missing_rate=0, boons=[]),
+    ],
+    ids=[
+        "no consumables",
+        "some consumables",
+        "no healing addon",
+        "some boon categories",
+        "no boons",
+    ],
+)
+def test_missing_sections(log):
+    pd.testing.assert_frame_equal(transform_log(log, "log"), _reference(log, "log"))
+
+
+def test_missing_boon_category_is_rejected():
+    log = _without(_log(20, missing_rate=0), "squadBuffsActive")
+    with pytest.raises(FightInvalidException):
+        _reference(log, "log")
+    with pytest.raises(FightInvalidException):
+        transform_log(log, "log")
+
+
+def test_multiple_fights_are_rejected():
+    log = _log(21, missing_rate=0)
+    player = log["players"][3]
+    player["dpsAll"] = player["dpsAll"] * 2
+    with pytest.raises(FightInvalidException):
+        _reference(log, "log")
+    with pytest.raises(FightInvalidException):
+        transform_log(log, "log")
+
+
+def test_partial_healing_stats_are_nan():
+    # Intended change: The old implementation raised a TypeError if only some players
+    # had the healing addon, now their healing and barrier are NaN.
+    log = _without(
+        _without(_log(22, missing_rate=0), "extHealingStats", 2), "extBarrierStats", 2
+    )
+    with pytest.raises(TypeError):
+        _reference(log, "log")
+    df = transform_log(log, "log")
+    healing = df[RENAMED_KEYS["healing"]]
+    barrier = df[RENAMED_KEYS["barrier"]]
+    assert healing.isna().any() and healing.notna().any()
+    assert (healing.isna() == barrier.isna()).all()
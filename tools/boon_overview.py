@@ -3,10 +3,11 @@ import plotly.graph_objects as go
 import streamlit as st
 
 from color_lib import spec_color_map
+from metrics import timed
 from process_logs import BOON_IDS
 
 
-def render_boon_overview(groups, group_means, filters):
+def render_boon_overview(group_info, group_means, filters):
     format = "%d.%m.%y %H:%M"
     time_range_string = (
         "("
@@ -24,47 +25,49 @@ def render_boon_overview(groups, group_means, filters):
     # if you want the absolute values
     # normalized_means = boon_means
 
-    fig = go.Figure()
-    spec_order = [s for s in spec_color_map.keys() if s in normalized_means.index]
-    for idx in spec_order:
-        row = normalized_means.loc[idx]
-        color = groups.get_group(idx)["spec_color"].value_counts().idxmax()
-        fig.add_trace(
-            go.Bar(
-                name=str(idx),
-                x=boon_means.columns,  # x needs the boon names (columns)
-                y=row.values,  # numeric values (call or use .values)
-                marker=dict(color=color, line_color="black", line_width=0.5),
-            ),
-        )
+    with timed("figure boon generation"):
+        fig = go.Figure()
+        spec_order = [s for s in spec_color_map.keys() if s in normalized_means.index]
+        for idx in spec_order:
+            row = normalized_means.loc[idx]
+            color = group_info.at[idx, "color"]
+            fig.add_trace(
+                go.Bar(
+                    name=str(idx),
+                    x=boon_means.columns,  # x needs the boon names (columns)
+                    y=row.values,  # numeric values (call or use .values)
+                    marker=dict(color=color, line_color="black", line_width=0.5),
+                ),
+            )
 
-    fig.update_layout(
-        barmode="stack",
-        title=f"Group Boon Generation {time_range_string}",
-        title_x=0.5,
-        xaxis_title="Boon",
-        yaxis_title="Normalized Generation",
-    )
-    st.write(fig)
+        fig.update_layout(
+            barmode="stack",
+            title=f"Group Boon Generation {time_range_string}",
+            title_x=0.5,
+            xaxis_title="Boon",
+            yaxis_title="Normalized Generation",
+        )
+        st.write(fig)
 
-    fig = go.Figure()
-    for idx in spec_order:
-        row = normalized_means.loc[idx]
-        marker = {
-            "color": groups.get_group(idx)["spec_color"].value_counts().idxmax(),
-        }
-        fig.add_trace(
-            go.Scatterpolar(
-                r=row.to_list(),
-                theta=boons_selectors,
-                fill="toself",
-                name=idx,
-                marker=marker,
+    with timed("figure boon radar"):
+        fig = go.Figure()
+        for idx in spec_order:
+            row = normalized_means.loc[idx]
+            marker = {
+                "color": group_info.at[idx, "color"],
+            }
+            fig.add_trace(
+                go.Scatterpolar(
+                    r=row.to_list(),
+                    theta=boons_selectors,
+                    fill="toself",
+                    name=idx,
+                    marker=marker,
+                )
             )
+        fig.update_layout(
+            title=f"Group Boon Generation {time_range_string}",
+            title_x=0.5,
+            template="plotly_dark",
         )
-    fig.update_layout(
-        title=f"Group Boon Generation {time_range_string}",
-        title_x=0.5,
-        template="plotly_dark",
-    )
-    st.write(fig)
+        st.write(fig)
@@ -2,11 +2,18 @@ import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 
+from aggregate_logs import (
+    MAX_PLOT_POINTS,
+    MAX_ROLLING_WINDOW,
+    distribution_sample,
+    rolling_averages,
+)
 from filter_logs import _HIDDEN_KEYS
+from metrics import timed
 from process_logs import BOON_CATEGORIES_OUT, BOON_IDS
 
 
-def render_stat_comparison(df, groups, group_means, filters):
+def render_stat_comparison(index, df, groups, group_means, group_info, filters):
     format = "%d.%m.%y %H:%M"
     time_range_string = (
         "("
@@ -29,6 +36,9 @@ def render_stat_comparison(df, groups, group_means, filters):
             help="Choose the data that you are interested in.",
         )
 
+    # Large selections only send a sample of each group to the browser
+    sampled = len(df) > MAX_PLOT_POINTS
+
     # violoin plot
     fig = go.Figure()
     try:
@@ -40,48 +50,55 @@ def render_stat_comparison(df, groups, group_means, filters):
         st.write("Nothing to see here ...")
         st.stop()
 
-    for group in sorted_keys.index:
-        marker = {
-            "color": groups.get_group(group)["spec_color"].value_counts().idxmax(),
-        }
-        if stat_selector in ["Time Alive (%)", "Bufffood (uptime%)"]:
-            fig.add_trace(
-                go.Bar(
-                    marker=marker,
-                    name=group,
-                    y=[sorted_keys[group]],
-                    x=[group],
+    with timed("figure distribution"):
+        for group in sorted_keys.index:
+            marker = {
+                "color": group_info.at[group, "color"],
+            }
+            if stat_selector in ["Time Alive (%)", "Bufffood (uptime%)"]:
+                fig.add_trace(
+                    go.Bar(
+                        marker=marker,
+                        name=group,
+                        y=[sorted_keys[group]],
+                        x=[group],
+                    )
                 )
-            )
-        else:
-            fig.add_trace(
-                go.Violin(
-                    jitter=1,
-                    marker=marker,
-                    meanline_visible=True,
-                    name=group,
-                    pointpos=0,
-                    points="all",
-                    spanmode="hard",
-                    y=groups.get_group(group)[stat_selector],
+            else:
+                values = groups.get_group(group)[stat_selector]
+                if sampled:
+                    values = distribution_sample(values)
+                fig.add_trace(
+                    go.Violin(
+                        jitter=1,
+                        marker=marker,
+                        meanline_visible=True,
+                        name=group,
+                        pointpos=0,
+                        points="all",
+                        spanmode="hard",
+                        y=values,
+                    )
                 )
-            )
 
-    fig.update_layout(
-        title=f"{stat_selector}  {time_range_string}",
-        title_x=0.5,
-        legend_traceorder="reversed",
-    )
-    st.plotly_chart(
-        fig,
-        use_container_width=True,
-        config={
-            "toImageButtonOptions": {
-                "format": "png",
-                "filename": f"{stat_selector.split("(")[0].replace(' ', '').lower()}",
+        if sampled:
+            time_range_string += f" (sampled, {len(df)} values)"
+        fig.update_layout(
+            title=f"{stat_selector}  {time_range_string}",
+            title_x=0.5,
+            legend_traceorder="reversed",
+        )
+        distribution_fig = fig
+        st.plotly_chart(
+            fig,
+            use_container_width=True,
+            config={
+                "toImageButtonOptions": {
+                    "format": "png",
+                    "filename": f"{stat_selector.split("(")[0].replace(' ', '').lower()}",
+                },
             },
-        },
-    )
+        )
 
     # rolling average
     rolling_average_help = """
@@ -91,28 +108,33 @@ def render_stat_comparison(df, groups, group_means, filters):
     metrics that vary wildly from fight to fight.
     """
     rolling_average_window = st.slider(
-        "Rolling Avgerage Window Size:", 1, 25, 5, help=rolling_average_help
+        "Rolling Avgerage Window Size:",
+        1,
+        MAX_ROLLING_WINDOW,
+        5,
+        help=rolling_average_help,
     )
-    df["rolling_average"] = (
-        df.groupby(filters.group_by)[stat_selector]
-        .rolling(rolling_average_window, win_type="triang")
-        .mean()
-        .reset_index(0, drop=True)
-    )
-    fig = go.Figure()
-    for group in sorted_keys.index:
-        marker = {
-            "color": groups.get_group(group)["spec_color"].value_counts().idxmax()
-        }
-        fig.add_trace(
-            go.Scatter(
-                marker=marker,
-                mode="markers+lines",
-                name=group,
-                x=groups.get_group(group)["timeStart"],
-                y=groups.get_group(group)["rolling_average"],
+    with timed("figure rolling average"):
+        # All window sizes are cached at once, so moving the slider only selects a column
+        rolling_average = rolling_averages(
+            index, filters, filters.group_by, stat_selector, df
+        )[rolling_average_window]
+        # WebGL renders many points a lot faster than SVG
+        scatter = go.Scattergl if sampled else go.Scatter
+        fig = go.Figure()
+        for group in sorted_keys.index:
+            marker = {"color": group_info.at[group, "color"]}
+            positions = groups.indices[group]
+            fig.add_trace(
+                scatter(
+                    marker=marker,
+                    mode="markers+lines",
+                    name=group,
+                    x=df["timeStart"].iloc[positions],
+                    y=rolling_average.iloc[positions],
+                )
             )
-        )
-    fig.update_layout(title=stat_selector, title_x=0.5, legend_traceorder="reversed")
-    fig.layout = {"xaxis": {"type": "category", "categoryorder": "category ascending"}}
-    st.write(fig)
+        fig.update_layout(title=stat_selector, title_x=0.5, legend_traceorder="reversed")
+        fig.layout = {"xaxis": {"type": "category", "categoryorder": "category ascending"}}
+        st.write(fig)
+    return {"Distribution": distribution_fig, "Rolling average": fig}